@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import mmfbase
+
+# Single-file project archive: a header, the files back to back, and an
+# index of (offset, length, name) at the end. The archive is memory-mapped
+# and get_file returns a memoryview into it, so nothing is read or copied
+# until a file is actually decoded.
+#
+# Pack a project directory with
+#
+#   python archive_reader.py "test project" test.mmfa
+
+MAGIC = b"MMFA"
+VERSION = 1
+
+HEADER = struct.Struct("<4sIQI")   # magic, version, index offset, entry count
+ENTRY = struct.Struct("<QQH")      # offset, length, name length (name follows)
+
+class Reader(mmfbase.Reader):
+
+    def __init__(self, fp):
+        super().__init__(fp)
+        with open(fp, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buf = memoryview(self._map)
+
+        magic, version, index, count = HEADER.unpack_from(self._buf)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a project archive" % fp)
+
+        self.index = {}
+        for _ in range(count):
+            offset, length, namelen = ENTRY.unpack_from(self._buf, index)
+            index += ENTRY.size
+            name = bytes(self._buf[index:index + namelen]).decode("utf-8")
+            index += namelen
+            self.index[name] = (offset, length)
+
+    def get_file(self, fn):
+        try:
+            offset, length = self.index[fn.replace(os.sep, "/")]
+        except KeyError:
+            raise FileNotFoundError(fn) from None
+        return self._buf[offset:offset + length]
+
+    def get_project_file(self):
+        return json.loads(bytes(self.get_file("project.json")))
+
+def pack(directory, out):
+    """Pack every file under directory into the archive out"""
+    names = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for fn in sorted(files):
+            if fn.endswith(".mmfc"):
+                continue   # jsondir_reader cache, useless inside an archive
+            path = os.path.join(root, fn)
+            names.append((os.path.relpath(path, directory).replace(os.sep, "/"), path))
+
+    with open(out, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+        entries = []
+        for name, path in names:
+            with open(path, "rb") as src:
+                data = src.read()
+            entries.append((name, f.tell(), len(data)))
+            f.write(data)
+
+        index = f.tell()
+        for name, offset, length in entries:
+            name = name.encode("utf-8")
+            f.write(ENTRY.pack(offset, length, len(name)) + name)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, index, len(entries)))
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python archive_reader.py <project directory> <archive>")
+        sys.exit(1)
+    pack(sys.argv[1], sys.argv[2])
@@ -1,4 +1,6 @@
-from mmfbase import Object, register, AxisNames
+import array
+
+from mmfbase import Object, ObjInfo, ObjectError, Exit, register, parse_sound, AxisNames
 
 @register("Background")
 class VisibleObject(Object):
@@ -6,53 +8,156 @@ class VisibleObject(Object):
     ATTRIBUTE_NAMES = ["Sprite name"]
     ACTIONS = [("Destroy", None), ("Move", list)]
     EVENTS = [("Collision", Object)]
+    STATIC = True  # Only moves through actions, may be drawn from a cached layer
+
+    __slots__ = ["_pos", "size", "_slot", "_static", "img"]
+
+    def __init__(self, game, objs, name, pos):
+        self.size = None  # Unknown until the sprite is loaded
+        self._slot = None  # Index into game.batch arrays in batch mode
+        self._static = False  # Drawn by the backend's static layer instead of tick()
+        super().__init__(game, objs, name, pos)
+
+    @property
+    def pos(self):
+        if self._slot is not None:
+            return self.game.batch.pos[self._slot].tolist()
+        return self._pos
+
+    @pos.setter
+    def pos(self, value):
+        if self._slot is not None:
+            self.game.batch.move(self._slot, value)
+        else:
+            self._pos = value
+        if self.size is not None and self in self.objs:  # Not while pooled or destroyed
+            self.update_spatial()
+        if self._static:
+            self.game.static_update(self, self.img, [value[0], -value[1]])
 
     # Overriden abstract methods
     def init(self):
         self.img = self.game.image_load(self.getattr("Sprite name"))
         self.size = [self.img.get_width(), self.img.get_height()]
+        if self.game.batch is not None:
+            self._slot = self.game.batch.add(self, self._pos, self.size)
+        self.update_spatial()
+        if self.STATIC:
+            self._static = self.game.static_update(self, self.img, [self._pos[0], -self._pos[1]])
 
     def check_event(self, name, arg):
         r = super().check_event(name, arg)
         if r: return r
         
         if name == "Collision":
-            frame = self.game.frames[self.game.current_frame]
-            for obj in frame.grid.find_objects(self.objs, arg):
-                if isinstance(obj, VisibleObject):
-                    if self.check_overlap(obj):
-                        return [self, obj]
-            return None
+            return self.collision(arg)
         else:
             return None
 
     def handle_action(self, name, arg):
         if name == "Move":
-            if not isinstance(arg, list):
-                raise TypeError("arg is not list")
-            if len(arg) != 2:
-                raise TypeError("arg is %dD vector, must be 2D" % len(arg))
-            if not isinstance(arg[0], int):
-                raise TypeError("arg.x is not int")
-            if not isinstance(arg[1], int):
-                raise TypeError("arg.y is not int")
-            
-            self.pos = arg
+            self.move_to(arg)
+
+    @classmethod
+    def compile_event(cls, name, arg):
+        if name == "Collision":
+            return lambda obj: obj.collision(arg)
+        return super().compile_event(name, arg)
+
+    @classmethod
+    def compile_action(cls, name, arg):
+        if name == "Move":
+            return lambda obj: obj.move_to(arg)
+        return super().compile_action(name, arg)
 
     def tick(self):
-        self.game.display.blit(self.img, [self.pos[0], -self.pos[1]])
+        pass
+
+    def draw(self):
+        if not self._static:
+            if self._slot is not None:
+                positions = self.game.batch.positions()
+                x = positions[2 * self._slot]
+                y = positions[2 * self._slot + 1]
+            else:
+                x, y = self._pos
+            self.game.display.blit(self.img, [x, -y])
+
+    def on_destroy(self):
+        self.game.image_release(self.img)
+        if self._static:
+            self.game.static_remove(self)
+            self._static = False
+        if self._slot is not None:
+            self.game.batch.remove(self, self._slot)
+            self._pos = self.game.batch.pos[self._slot].tolist()
+            self._slot = None
+        self.game.spatial.remove(self)
+
+    # Positions are packed into one array per type, x0, y0, x1, y1, ...,
+    # there can be thousands
+    @classmethod
+    def save_states(cls, objs, index):
+        res = array.array("d")
+        if objs:
+            batch = objs[0].game.batch
+            if batch is None:
+                res.fromlist([c for obj in objs for c in obj._pos])
+            else:
+                res.frombytes(batch.pack([obj._slot for obj in objs]))
+        return res
+
+    @classmethod
+    def load_states(cls, objs, states, all_objs):
+        if cls.save_states(objs, None) == states:
+            return   # Usually the case for Backgrounds
+        for obj, x, y in zip(objs, states[0::2], states[1::2]):
+            if obj._slot is not None or obj._pos != [x, y]:
+                obj.pos = [x, y]
+
+    def revive(self):
+        self.init()   # Only loads the (cached) image and rejoins the spatial hash/batch/static layer
 
     # VisibleObject internal methods
+    def collision(self, name):
+        if self not in self.objs:
+            return None   # Destroyed earlier in the row that is checking it
+        x, y = self.pos
+        candidates = self.game.spatial.query(name, x, y, x + self.size[0], y + self.size[1])
+        if self._slot is not None and len(candidates) >= self.game.batch.COLLIDE_MIN:
+            # Batch mode, everything in game.spatial has a slot
+            i = self.game.batch.collide(self._slot, [obj._slot for obj in candidates])
+            return None if i < 0 else [self, candidates[i]]
+        for obj in candidates:
+            if isinstance(obj, VisibleObject):
+                if self.check_overlap(obj):
+                    return [self, obj]
+        return None
+
+    def move_to(self, arg):
+        if not isinstance(arg, list):
+            raise TypeError("arg is not list")
+        if len(arg) != 2:
+            raise TypeError("arg is %dD vector, must be 2D" % len(arg))
+        if not isinstance(arg[0], int):
+            raise TypeError("arg.x is not int")
+        if not isinstance(arg[1], int):
+            raise TypeError("arg.y is not int")
+
+        self.pos = arg
+
+    def update_spatial(self):
+        x, y = self.pos
+        self.game.spatial.move(self, x, y, x + self.size[0], y + self.size[1])
+
     def check_overlap(self, other):
-        self_x0 = self.pos[0]
-        self_x1 = self.pos[0] + self.size[0]
-        self_y0 = self.pos[1]
-        self_y1 = self.pos[1] + self.size[1]
+        self_x0, self_y0 = self.pos
+        self_x1 = self_x0 + self.size[0]
+        self_y1 = self_y0 + self.size[1]
         
-        other_x0 = other.pos[0]
-        other_x1 = other.pos[0] + other.size[0]
-        other_y0 = other.pos[1]
-        other_y1 = other.pos[1] + other.size[1]
+        other_x0, other_y0 = other.pos
+        other_x1 = other_x0 + other.size[0]
+        other_y1 = other_y0 + other.size[1]
 
         p0res = (other_x0 >= self_x0 and other_x0 <= self_x1) and\
                 (other_y0 >= self_y0 and other_y0 <= self_y1)
@@ -73,13 +178,77 @@ class Active(VisibleObject):
 
     ATTRIBUTE_NAMES = VisibleObject.ATTRIBUTE_NAMES + \
                       ["Movement type", "Damping value", "Speed"]
+    STATIC = False
+
+    __slots__ = ["_vx", "_vy"]
+
+    @property
+    def vx(self):
+        if self._slot is not None:
+            return float(self.game.batch.vel[self._slot, 0])
+        return self._vx
+
+    @vx.setter
+    def vx(self, value):
+        if self._slot is not None:
+            self.game.batch.vel[self._slot, 0] = value
+        else:
+            self._vx = value
+
+    @property
+    def vy(self):
+        if self._slot is not None:
+            return float(self.game.batch.vel[self._slot, 1])
+        return self._vy
+
+    @vy.setter
+    def vy(self, value):
+        if self._slot is not None:
+            self.game.batch.vel[self._slot, 1] = value
+        else:
+            self._vy = value
 
     def init(self):
         super().init()
         self.vx = 0
         self.vy = 0
+        if self._slot is not None:
+            mvtype = self.getattr("Movement type")
+            if not self.game.batch.set_movement(self._slot, mvtype, self.getattr("Damping value"), self.getattr("Speed")):
+                raise ObjectError("Unknown movement type %s" % mvtype)
+
+    # Positions as for VisibleObject, then every vx, then every vy
+    @classmethod
+    def save_states(cls, objs, index):
+        res = array.array("d")
+        if objs:
+            batch = objs[0].game.batch
+            if batch is None:
+                res.fromlist([c for obj in objs for c in obj._pos])
+                res.fromlist([obj._vx for obj in objs])
+                res.fromlist([obj._vy for obj in objs])
+            else:
+                res.frombytes(batch.pack([obj._slot for obj in objs], velocity=True))
+        return res
+
+    @classmethod
+    def load_states(cls, objs, states, all_objs):
+        if objs and objs[0].game.batch is not None:
+            objs[0].game.batch.unpack([obj._slot for obj in objs], states, velocity=True)
+            return
+        n = len(objs)
+        for obj, x, y, vx, vy in zip(objs, states[0:2 * n:2], states[1:2 * n:2], states[2 * n:3 * n], states[3 * n:]):
+            obj.vx = vx
+            obj.vy = vy
+            if obj._slot is not None or obj._pos != [x, y]:
+                obj.pos = [x, y]
 
     def tick(self):
+        if self._slot is None:  # Batch mode moves every Active at once in Batch.step
+            self.move()
+
+    # Active internal methods
+    def move(self):
         mvtype = self.getattr("Movement type")
         if mvtype == "None":
             pass
@@ -93,14 +262,184 @@ class Active(VisibleObject):
         else:
             raise ObjectError("Unknown movement type %s" % mvtype)
 
-        damping = self.getattr("Damping value") ** self.game.get_time()
+        dt = self.game.step_time()
+        damping = self.getattr("Damping value") ** dt
         self.vx *= damping
         self.vy *= damping
         # print(self.vx, self.vy)
         
         self.pos = [
-            self.pos[0] + self.vx * self.game.get_time(),
-            self.pos[1] + self.vy * self.game.get_time()
+            self.pos[0] + self.vx * dt,
+            self.pos[1] + self.vy * dt
         ]
 
-        super().tick()
+@register("Game")
+class GameObject(Object):
+
+    ATTRIBUTE_NAMES = Object.ATTRUBUTE_NAMES
+    EVENTS = Object.EVENTS + [("Timer expired", str), ("Frame start",)]
+    ACTIONS = Object.ACTIONS + [
+        ("Set timer #0", float),
+        ("Set timer #1", float),
+        ("Set timer #2", float),
+        ("Set timer #3", float),
+        ("Set timer #4", float),
+        ("Set timer #5", float),
+        ("Set timer #6", float),
+        ("Set timer #7", float),
+        ("Set timer #8", float),
+        ("Set timer #9", float),
+        ("Close game window",),
+        ("Create object", dict),
+        ("Camera: Move", list),
+        ("Camera: Follow object", str),
+        ("Play sound", str),
+        ("Play music", str)
+    ]
+
+    __slots__ = ["timers", "frame_start_sent", "cam_following"]
+    
+    def init(self):
+        self.timers = {}
+        self.frame_start_sent = False
+        self.cam_following = None
+        self.game.triggers.fire(("Frame start",))
+
+    def tick(self):
+        if self.cam_following is not None:
+            self.game.camerax = self.cam_following.pos[0] - 800 // 2
+            self.game.cameray = -self.cam_following.pos[1] - 600 // 2
+
+    def check_event(self, name, arg):
+        if name == "Timer expired":
+            return self.timer_expired(arg)
+
+        elif name == "Frame start":
+            return self.frame_start()
+
+    def on_destroy(self):
+        raise Exit
+
+    def save_state(self, index):
+        now = self.game.now()
+        return ({n: (start - now, length) for n, (start, length) in self.timers.items()},
+                self.frame_start_sent, index.get(self.cam_following, -1))
+
+    def load_state(self, state, objs):
+        timers, self.frame_start_sent, following = state
+        now = self.game.now()
+        self.timers = {n: [now + start, length] for n, (start, length) in timers.items()}
+        self.cam_following = objs[following] if following >= 0 else None
+
+    def handle_action(self, name, value):
+        if name.startswith("Set timer #"):
+            self.set_timer(int(name[-1]), value)
+
+        elif name == "Close game window":
+            self.close_window()
+        
+        elif name == "Create object":
+            self.create_object(value)
+
+        elif name == "Camera: Move":
+            self.camera_move(value)
+
+        elif name == "Camera: Follow object":
+            self.camera_follow(value)
+
+        elif name == "Play sound":
+            self.play_sound(value)
+
+        elif name == "Play music":
+            self.play_music(value)
+
+    @classmethod
+    def event_trigger(cls, name, arg):
+        if name == "Timer expired":
+            return ("Timer expired", arg)
+        elif name == "Frame start":
+            return ("Frame start",)
+        return super().event_trigger(name, arg)
+
+    @classmethod
+    def compile_event(cls, name, arg):
+        if name == "Timer expired":
+            return lambda obj: obj.timer_expired(arg)
+        elif name == "Frame start":
+            return cls.frame_start
+        return super().compile_event(name, arg)
+
+    @classmethod
+    def compile_action(cls, name, value):
+        if name.startswith("Set timer #"):
+            timern = int(name[-1])
+            return lambda obj: obj.set_timer(timern, value)
+        elif name == "Close game window":
+            return cls.close_window
+        elif name == "Create object":
+            objinfo = cls.parse_create_object(value)
+            return lambda obj: obj.create_from(objinfo)
+        elif name == "Camera: Move":
+            return lambda obj: obj.camera_move(value)
+        elif name == "Camera: Follow object":
+            return lambda obj: obj.camera_follow(value)
+        elif name == "Play sound":
+            path, priority = parse_sound(value)
+            return lambda obj: obj.game.play_sound(path, priority)
+        elif name == "Play music":
+            return lambda obj: obj.play_music(value)
+        return super().compile_action(name, value)
+
+    # GameObject internal methods
+    def timer_expired(self, timern):
+        # print(self.timers, repr(timern))
+        if timern not in self.timers:
+            return
+        if self.game.now() - self.timers[timern][0] > self.timers[timern][1]:
+            del self.timers[timern]
+            return [self]
+
+    def frame_start(self):
+        if not self.frame_start_sent:
+            self.frame_start_sent = True
+            return [self]
+
+    def set_timer(self, timern, value):
+        now = self.game.now()
+        self.timers[timern] = [now, value]
+        self.game.triggers.schedule(now + value, ("Timer expired", timern))
+
+    def close_window(self):
+        raise Exit
+
+    @staticmethod
+    def parse_create_object(value):
+        try:
+            return ObjInfo.from_dict(value)
+        except KeyError as e:
+            raise ObjectError("Create object failed: " + str(e))
+
+    def create_object(self, value):
+        self.create_from(self.parse_create_object(value))
+
+    def create_from(self, objinfo):
+        objinfo.create_object(self.game, self.objs)
+        objinfo.fill_attributes()
+
+    def camera_move(self, value):
+        self.game.camerax = value[0]
+        self.game.cameray = -value[1]
+
+    def camera_follow(self, value):
+        if value is None:
+            self.cam_following = None
+        else:
+            self.cam_following = self.game.frames[self.game.current_frame].grid.find_objects(self.objs, value)[0]
+            self.game.camerax = self.cam_following.pos[0] - 800 // 2
+            self.game.cameray = -self.cam_following.pos[1] - 600 // 2
+
+    def play_sound(self, value):
+        self.game.play_sound(*parse_sound(value))
+
+    def play_music(self, value):
+        self.game.mus_play(value)
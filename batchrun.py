@@ -0,0 +1,157 @@
+### Headless batch runner ###
+# Runs many (project, frame, input script, frame budget) jobs on the mmfnull
+# engine across a process pool and prints one JSON object per finished job,
+# in completion order, e.g.
+#
+#   python batchrun.py jobs.jsonl > results.jsonl
+#
+# Every line of the jobs file is a JSON object:
+#
+#   {"project": "test project", "frame": 0, "frames": 600,
+#    "input": [[0, "axis", "P1_HORIZONTAL", 1], [30, "press", "ESC"], [31, "release", "ESC"]]}
+#
+# "frame" defaults to 0 and "frames" (the frame budget) to unlimited.
+# "input" is a list of [frame, "axis", axis, value], [frame, "press", key]
+# or [frame, "release", key] entries, applied before that frame (counting
+# from 0) is simulated. Axes are AxisNames attribute names or numbers.
+# Instead of a list, "input" may name a JSON file holding one. Any other
+# keys, like an "id", are copied to the result.
+
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import importlib
+import traceback
+import multiprocessing
+
+import mmfbase
+
+_engine = None
+_reader_cls = None
+_projects = {}   # Project path -> (reader, parsed project), per worker process
+
+def _init_worker(reader):
+    global _engine, _reader_cls
+    _engine = importlib.import_module("mmfnull")   # Registers its own Input, so only in the workers
+    import objects
+    _reader_cls = importlib.import_module(reader).Reader
+
+def _load_project(path):
+    entry = _projects.get(path)
+    if entry is None:
+        reader = _reader_cls(path)
+        entry = _projects[path] = (reader, reader.get_project_file())
+    return entry
+
+def load_script(script):
+    """Input script entries sorted by frame, with axis names resolved"""
+    if isinstance(script, str):
+        with open(script) as f:
+            script = json.load(f)
+    res = []
+    for entry in script:
+        frame, command, *args = entry
+        if command == "axis":
+            axis, value = args
+            if isinstance(axis, str):
+                axis = getattr(mmfbase.AxisNames, axis)
+            args = [axis, value]
+        elif command not in ("press", "release"):
+            raise ValueError("Unknown input command %r" % command)
+        res.append((frame, command, args))
+    res.sort(key=lambda entry: entry[0])
+    return res
+
+def object_state(obj, type_names):
+    # The project's type name ("Background"), not the class's ("VisibleObject")
+    state = {"type": type_names.get(obj.__class__, obj.__class__.__name__), "name": obj.name, "pos": list(obj.pos)}
+    if hasattr(obj, "vx"):
+        state["vel"] = [obj.vx, obj.vy]
+    return state
+
+def run_job(job):
+    result = {key: value for key, value in job.items() if key not in ("project", "input")}
+    result["project"] = job["project"]
+    try:
+        reader, project = _load_project(job["project"])
+        script = load_script(job.get("input", []))
+        if isinstance(project, dict):
+            # Attribute writes go to the parsed dicts, keep them from
+            # leaking into the next job with this project
+            project = copy.deepcopy(project)
+
+        start = time.perf_counter()
+        game = _engine.Game.from_dict(reader, project)
+        game.max_frames = job.get("frames")
+        game.switch_frame(job.get("frame", 0))
+        load_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        i = 0
+        try:
+            while True:
+                while i < len(script) and script[i][0] <= game.frame_count:
+                    _, command, args = script[i]
+                    if command == "axis":
+                        game.set_axis(*args)
+                    elif command == "press":
+                        game.press(*args)
+                    else:
+                        game.release(*args)
+                    i += 1
+                game.update()
+        except mmfbase.Exit:
+            if game.max_frames is not None and game.frame_count >= game.max_frames:
+                result["exit"] = "budget"
+            else:
+                result["exit"] = "exit"
+        total = time.perf_counter() - start
+        game.exit()
+
+        type_names = {cls: name for name, cls in mmfbase.ObjInfo.OBJ_TYPES.items()}
+        result.update({
+            "frames_simulated": game.frame_count,
+            "fps": game.frame_count / total if total else None,
+            "load_time": load_time,
+            "time": total,
+            "objects": [object_state(obj, type_names) for obj in game.objs],
+        })
+    except Exception:
+        result["exit"] = "error"
+        result["error"] = traceback.format_exc()
+    return result
+
+def read_jobs(path):
+    with (sys.stdin if path == "-" else open(path)) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run headless game jobs on a process pool, print results as JSON lines")
+    parser.add_argument("jobs", help="JSON lines file of jobs, - for stdin")
+    parser.add_argument("--reader", default="jsondir_reader", help="file format module (default: jsondir_reader)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes (default: one per core)")
+    parser.add_argument("--output", help="append results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    jobs = list(read_jobs(args.jobs))
+    # Keep jobs for the same project together so workers hit their cache
+    jobs.sort(key=lambda job: job["project"])
+
+    out = open(args.output, "a") if args.output else sys.stdout
+    try:
+        with multiprocessing.Pool(args.workers, _init_worker, (args.reader,)) as pool:
+            for result in pool.imap_unordered(run_job, jobs):
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    main()
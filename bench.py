@@ -0,0 +1,192 @@
+### Engine benchmark ###
+# Generates synthetic projects of a given size, runs each for a number of
+# frames in a fresh process (so peak memory is that run's) and prints one
+# JSON object per run, e.g.
+#
+#   python bench.py --objects 10,1000,100000 --frames 300 > results.jsonl
+
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import struct
+import argparse
+import tempfile
+import importlib
+import tracemalloc
+import multiprocessing
+
+import mmfbase
+
+SPRITE_SIZE = 32
+
+def make_png(width, height, rgb):
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    row = b"\x00" + bytes(rgb) * width
+    return b"\x89PNG\r\n\x1a\n" + \
+           chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)) + \
+           chunk(b"IDAT", zlib.compress(row * height)) + \
+           chunk(b"IEND", b"")
+
+def make_project(objects, active_share=0.1, duplicate_share=0.9, names=8, rows=8, seed=0):
+    """Project dict with one frame holding about `objects` Backgrounds/Actives.
+
+    Objects are spread over `names` names per type on a square grid;
+    `duplicate_share` of them are duplicates of the first object with their
+    name. `rows` event grid rows make the player and the Actives collide with
+    the tiles and juggle timers."""
+    rng = random.Random(seed)
+    side = max(1, int(objects ** 0.5))
+    objs = [
+        {"type": "Input", "pos": [0, 0], "name": "Input", "attrib": {}, "duplicate_of": None},
+        {"type": "Game", "pos": [0, 0], "name": "Game", "attrib": {}, "duplicate_of": None},
+        {"type": "Active", "pos": [0, 0], "name": "player", "duplicate_of": None, "attrib": {
+            "Sprite name": "player.png", "Movement type": "Top-down", "Damping value": 0.001, "Speed": 128}},
+    ]
+    prototypes = {}
+    for i in range(objects):
+        active = rng.random() < active_share
+        name = ("mover%d" if active else "tile%d") % rng.randrange(names)
+        pos = [(i % side) * SPRITE_SIZE, -(i // side) * SPRITE_SIZE]
+        if name in prototypes and rng.random() < duplicate_share:
+            objs.append({"type": "Active" if active else "Background", "pos": pos, "name": name,
+                         "attrib": None, "duplicate_of": prototypes[name]})
+            continue
+        if active:
+            attrib = {"Sprite name": "mover.png", "Movement type": "None", "Damping value": 0.5, "Speed": 0}
+        else:
+            attrib = {"Sprite name": "tile.png"}
+        prototypes.setdefault(name, len(objs))
+        objs.append({"type": "Active" if active else "Background", "pos": pos, "name": name,
+                     "attrib": attrib, "duplicate_of": None})
+
+    grid = []
+    for i in range(rows):
+        kind = i % 3
+        if kind == 0:
+            event = {"name": "Collision", "objname": "player", "arg": "tile%d" % (i % names)}
+            actions = [{"name": "Set timer #%d" % (i % 10), "objname": "Game", "value": 0.5}]
+        elif kind == 1:
+            event = {"name": "Collision", "objname": "mover%d" % (i % names), "arg": "tile%d" % (i % names)}
+            actions = [{"name": "Camera: Move", "objname": "Game", "value": [0, 0]}]
+        else:
+            event = {"name": "Timer expired", "objname": "Game", "arg": i % 10}
+            actions = [{"name": "Camera: Follow object", "objname": "Game", "value": "player"}]
+        grid.append([event, actions])
+
+    return {"frames": [{"objs": objs, "grid": grid}]}
+
+def write_project(path, project):
+    with open(os.path.join(path, "project.json"), "w") as f:
+        json.dump(project, f)
+    for name, rgb in [("player.png", (255, 255, 0)), ("mover.png", (0, 255, 0)), ("tile.png", (128, 0, 0))]:
+        with open(os.path.join(path, name), "wb") as f:
+            f.write(make_png(SPRITE_SIZE, SPRITE_SIZE, rgb))
+
+def peak_rss_kb():
+    """Peak resident set size of this process so far, None where the
+    resource module is missing (Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_one(engine, reader_cls, path, frames, batch=False, trace_memory=False, split=False):
+    if trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    reader = reader_cls(path)
+    game = engine.Game.from_dict(reader, reader.get_project_file())
+    if batch:
+        game.enable_batch()
+    if hasattr(game, "set_axis"):
+        game.set_axis(mmfbase.AxisNames.P1_HORIZONTAL, 1)
+    game.switch_frame(0)
+    load_time = time.perf_counter() - start
+    if split:
+        # Per-stage times come from the profiler, which also times every
+        # row and object tick, so fps is lower than without it
+        game.enable_profiling()
+
+    simulated = 0
+    start = time.perf_counter()
+    try:
+        for _ in range(frames):
+            game.update()
+            simulated += 1
+    except mmfbase.Exit:
+        pass
+    total = time.perf_counter() - start
+    game.exit()
+
+    result = {
+        "objects": len(game.objs),
+        "frames": simulated,
+        "fps": simulated / total if total else None,
+        "load_time": load_time,
+        "time": total,
+        "peak_rss_kb": peak_rss_kb(),   # Of the whole process, see _run_isolated
+    }
+    if split:
+        result["split"] = dict(game.profiler.stages)
+    if trace_memory:
+        result["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+def _run_isolated(engine, reader, *args):
+    # run_one in a process of its own. ru_maxrss never goes down, so in a
+    # shared process every run after the largest would report its peak
+    engine = importlib.import_module(engine)
+    reader_cls = importlib.import_module(reader).Reader
+    import objects   # Only the type manifest, needed to find the project's types; they load on first use
+    return run_one(engine, reader_cls, *args)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run synthetic projects and report timings as JSON lines")
+    parser.add_argument("--engine", default="mmfnull", help="rendering engine module (default: mmfnull)")
+    parser.add_argument("--reader", default="jsondir_reader", help="file format module (default: jsondir_reader)")
+    parser.add_argument("--objects", default="10,100,1000,10000", help="comma separated object counts")
+    parser.add_argument("--active-share", type=float, default=0.1)
+    parser.add_argument("--duplicate-share", type=float, default=0.9)
+    parser.add_argument("--names", type=int, default=8, help="distinct names per object type")
+    parser.add_argument("--rows", type=int, default=8, help="event grid rows")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--batch", action="store_true", help="enable NumPy batch mode")
+    parser.add_argument("--trace-memory", action="store_true", help="report tracemalloc peak (slow)")
+    parser.add_argument("--split", action="store_true", help="report time per update stage (profiled, slower)")
+    parser.add_argument("--output", help="append results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    spawn = multiprocessing.get_context("spawn")
+    out = open(args.output, "a") if args.output else sys.stdout
+    try:
+        for count in [int(i) for i in args.objects.split(",")]:
+            project = make_project(count, args.active_share, args.duplicate_share, args.names, args.rows)
+            with tempfile.TemporaryDirectory() as path:
+                write_project(path, project)
+                with spawn.Pool(1) as pool:
+                    result = pool.apply(_run_isolated, (args.engine, args.reader, path, args.frames,
+                                                        args.batch, args.trace_memory, args.split))
+            result.update({
+                "engine": args.engine,
+                "requested_objects": count,
+                "active_share": args.active_share,
+                "duplicate_share": args.duplicate_share,
+                "rows": args.rows,
+                "batch": args.batch,
+            })
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,34 @@
 import os
 import json
 import mmfbase
+import projectcache
 
 class Reader(mmfbase.Reader):
 
+    USE_CACHE = True    # Load project.mmfc instead of parsing project.json when it is up to date
+
     def get_file(self, fn):
         return os.path.join(self.fp, fn)
 
     def get_project_file(self):
-        with open(os.path.join(self.fp, "project.json"), "rb") as f:
-            return json.loads(f.read())
+        json_path = os.path.join(self.fp, "project.json")
+        if not self.USE_CACHE:
+            with open(json_path, "rb") as f:
+                return json.loads(f.read())
+
+        cache_path = os.path.join(self.fp, "project.mmfc")
+        try:
+            project = projectcache.CachedProject(cache_path)
+        except (OSError, ValueError, projectcache.CacheError):
+            pass
+        else:
+            if project.is_valid_for(json_path):
+                return project
+            project.close()
+
+        try:
+            return projectcache.build(json_path, cache_path)
+        except OSError:
+            # Read-only project directory, just don't cache
+            with open(json_path, "rb") as f:
+                return json.loads(f.read())
@@ -1,18 +1,58 @@
 ### CONFIG ###
 # Replace "mmfpygame" with another filename (no extension) to select
-# another rendering engine.
-from mmfpygame import Game
+# another rendering engine ("mmfnull" runs headless; batchrun.py runs
+# many headless jobs in parallel).
+ENGINE = "mmfpygame"
 # Replace "jsondir_reader" with another filename to select another
-# file format
-from jsondir_reader import Reader
+# file format ("archive_reader" loads a single packed .mmfa file)
+READER = "jsondir_reader"
+# Set to True to keep object positions in NumPy arrays (needs numpy),
+# faster for levels with thousands of objects
+BATCH_MODE = False
+# Logic steps per second, independent of the render rate. None runs one
+# variable-length step per rendered frame
+TICK_RATE = None
+# Set to a filename to profile event rows, actions and object types and
+# write the report there on exit
+PROFILE = None
+# Set to a filename to record every frame's input and frame time there,
+# replay it with "python replay.py <project> <file>"
+RECORD = None
+# Set to True to print how long startup took: imports, reading the
+# project, engine init, loading the first frame and running it
+REPORT_STARTUP = False
 
 
 
 
 #### CODE ####
-import objects
+import time
+import importlib
 
 if __name__ == "__main__":
+    start = time.perf_counter()
+    import objects   # Only the type manifest, types load when a frame uses them
+    Reader = importlib.import_module(READER).Reader
+    import_time = time.perf_counter() - start
+
+    start = time.perf_counter()
     reader = Reader("test project")
-    game = Game.from_dict(reader, reader.get_project_file())
+    project = reader.get_project_file()
+    parse_time = time.perf_counter() - start
+
+    # The engine (and pygame with it) only loads once the project is read
+    start = time.perf_counter()
+    Game = importlib.import_module(ENGINE).Game
+    import_time += time.perf_counter() - start
+    start = time.perf_counter()
+    game = Game.from_dict(reader, project)
+    game.startup_times.update({"import": import_time, "parse": parse_time, "init": time.perf_counter() - start})
+    game.report_startup = REPORT_STARTUP
+    if BATCH_MODE:
+        game.enable_batch()
+    game.tick_rate = TICK_RATE
+    if PROFILE is not None:
+        game.enable_profiling(PROFILE)
+    if RECORD is not None:
+        game.enable_recording(RECORD)
     game.run()
@@ -1,4 +1,14 @@
 import abc
+import json
+import array
+import heapq
+import time
+import importlib
+import threading
+import collections
+import concurrent.futures
+
+import savestate
 
 class Frame():
 
@@ -22,6 +32,47 @@ class Frame():
         
         return cls(objs, EventGrid.from_dict(d["grid"]))
 
+    def attribute_values(self, name):
+        """Values of attribute name across the frame's objects, including
+        objects made by "Create object" actions"""
+        attribs = [i.attrib for i in self.objs]
+        for actions in self.grid.grid.values():
+            for action in actions:
+                if action.name == "Create object" and isinstance(action.value, dict):
+                    attribs.append(action.value.get("attrib"))
+        return {i[name] for i in attribs if isinstance(i, dict) and name in i}
+
+    def sound_paths(self):
+        """Sounds the frame's "Play sound" actions use"""
+        return {parse_sound(action.value)[0]
+                for actions in self.grid.grid.values() for action in actions if action.name == "Play sound"}
+
+class FrameList():
+    """Sequence of Frames, each built from its dict the first time it is used"""
+
+    __slots__ = ["source", "frames", "lock"]
+
+    def __init__(self, source):
+        self.source = source
+        self.frames = [None] * len(source)
+        self.lock = threading.Lock()   # Frames may be built by Game.preload_frame
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, n):
+        frame = self.frames[n]
+        if frame is None:
+            with self.lock:
+                frame = self.frames[n]
+                if frame is None:
+                    frame = self.frames[n] = Frame.from_dict(self.source[n])
+        return frame
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
 class Exit(Exception):
     pass
 
@@ -83,23 +134,156 @@ class Game(abc.ABC):
         self.cameray = 0
         self.current_frame = None
         self.frames = []
-        self.objs = set()
+        self.objs = ObjectSet()
+        self.spatial = SpatialHash()
+        self.batch = None          # numpybatch.Batch when batch mode is on
+        self.triggers = Triggers()
+        self.profiler = None       # profiler.Profiler when profiling is on
+        self.tick_rate = None      # Logic steps per second, None to step once per rendered frame
+        self.max_steps = 5         # Most logic steps per rendered frame before dropping time
+        self.render = True         # False skips drawing and post_update (e.g. servers)
+        self._accumulator = 0.0
+        self._preload_pool = None
+        self._preloads = {}        # Frame number -> Future from preload_frame
+        self.pools = {}            # Object class -> destroyed instances ready for reuse
+        self._released = []        # Destroyed this frame, pooled when the frame is over
+        self._next_uid = 0         # Object.uid of the next object created
+        self._layout = None        # SnapshotLayout of the last snapshot
+        self.startup_times = {}    # Startup phase -> seconds, see startup_report
+        self.report_startup = False
         self.fileloader = fileloader
 
         self.init()
 
     def run(self):
+        start = time.perf_counter()
+        imported = ObjInfo.import_time
         self.switch_frame(0)
+        imported = ObjInfo.import_time - imported   # Object types first used by this frame
+        self.startup_times["import"] = self.startup_times.get("import", 0.0) + imported
+        self.startup_times["assets"] = time.perf_counter() - start - imported
+        start = time.perf_counter()
         while 1:
             try:
-                self.pre_update()
-                self.frames[self.current_frame].grid.tick(self.objs)
-                for obj in self.objs:
-                    obj.tick()
-                self.post_update()
+                self.update()
             except Exit:
                 self.exit()
+                if self._preload_pool is not None:
+                    self._preload_pool.shutdown(wait=False)
+                if self.profiler is not None:
+                    self.profiler.dump()
                 return
+            if start is not None:
+                self.startup_times["first_frame"] = time.perf_counter() - start
+                start = None
+                if self.report_startup:
+                    print(self.startup_report())
+
+    def startup_report(self):
+        """One line with the startup phases measured so far. import and parse
+        are filled in by whoever imported the modules and read the project"""
+        phases = ["import", "parse", "init", "assets", "first_frame"]
+        return "Startup: " + ", ".join("%s %.1f ms" % (name.replace("_", " "), self.startup_times[name] * 1000)
+                                       for name in phases if name in self.startup_times)
+
+    def update(self):
+        """Run one frame: as many logic steps as are due, then draw it"""
+        if self._released:
+            self._pool_released()
+        if self.profiler is not None:
+            self._update_profiled()
+            return
+        self.pre_update()
+        for _ in range(self.logic_steps()):
+            self.update_events()
+            self.update_objects()
+        if self.render:
+            self.draw_objects()
+            self.post_update()
+
+    def logic_steps(self):
+        """Logic steps due this frame, call once per frame after pre_update"""
+        if self.tick_rate is None:
+            return 1
+
+        step = 1 / self.tick_rate
+        self._accumulator += self.get_time()
+        steps = int(self._accumulator / step)
+        if steps > self.max_steps:
+            # Too far behind, drop the rest instead of spiralling
+            steps = self.max_steps
+            self._accumulator = 0.0
+        else:
+            self._accumulator -= steps * step
+        return steps
+
+    def step_time(self):
+        """Game time covered by one logic step, in seconds"""
+        if self.tick_rate is None:
+            return self.get_time()
+        return 1 / self.tick_rate
+
+    def update_events(self):
+        self.triggers.poll(self.now())
+        self.frames[self.current_frame].grid.tick(self.objs)
+
+    def update_objects(self):
+        if self.batch is not None:
+            self.batch.step()
+        for obj in self.objs:
+            obj.tick()
+
+    def draw_objects(self):
+        for obj in self.objs:
+            obj.draw()
+
+    def _update_profiled(self):
+        # Same as update(), with every stage timed
+        try:
+            self._profile_stage("pre_update", self.pre_update)
+            for _ in range(self.logic_steps()):
+                self._profile_stage("events", self.update_events)
+                self._profile_stage("objects", self._update_objects_profiled)
+            if self.render:
+                self._profile_stage("draw", self.draw_objects)
+                self._profile_stage("post_update", self.post_update)
+        finally:
+            self.profiler.end_frame()
+
+    def _profile_stage(self, name, stage):
+        start = time.perf_counter()
+        try:
+            stage()
+        finally:
+            self.profiler.stage(name, time.perf_counter() - start)
+
+    def _update_objects_profiled(self):
+        if self.batch is not None:
+            self.batch.step()
+        clock = time.perf_counter
+        for obj in self.objs:
+            start = clock()
+            obj.tick()
+            self.profiler.object_tick(obj.__class__, clock() - start)
+
+    def now(self):
+        """Clock used for timers, in seconds"""
+        return time.perf_counter()
+
+    def enable_profiling(self, path=None):
+        """Record per-row, per-action and per-object-type timings.
+
+        The report is available from self.profiler.report() and written to
+        path as JSON when run() ends."""
+        import profiler
+        self.profiler = profiler.Profiler(path)
+        if self.current_frame is not None:
+            self._compile_grid()
+
+    def enable_batch(self):
+        """Keep VisibleObject positions/velocities in NumPy arrays. Call before run()"""
+        import numpybatch   # Optional dependency, only needed in batch mode
+        self.batch = numpybatch.Batch(self)
 
     @abc.abstractmethod
     def init(self):
@@ -121,10 +305,61 @@ class Game(abc.ABC):
     def sfx_load(self, path):
         ...
 
+    def image_release(self, img):
+        """Called when an object stops using an image returned by image_load/image_scale"""
+
+    def sfx_release(self, sfx):
+        """Called when an object stops using a sound returned by sfx_load"""
+
+    def static_update(self, obj, img, pos):
+        """Add or move a sprite that stays put between actions.
+
+        Returns True if the backend draws it from now on, in which case the
+        object must not blit it itself."""
+        return False
+
+    def static_remove(self, obj):
+        """Stop drawing a sprite added with static_update"""
+
+    def play_sound(self, path, priority=0):
+        """Play a sound effect. Backends with a limited number of voices
+        drop or cut off lower priority sounds first"""
+        sfx = self.sfx_load(path)
+        sfx.play()
+        self.sfx_release(sfx)
+
     @abc.abstractmethod
     def mus_play(self, path):
         ...
 
+    def engine_state(self):
+        """Backend state that snapshot() should capture (clock, injected
+        input...), as values savestate can encode"""
+        return None
+
+    def set_engine_state(self, state):
+        """Counterpart of engine_state, called by restore()"""
+
+    def preload_assets(self, frame):
+        """Decode the assets frame's objects will load. Runs on a worker thread"""
+
+    def preload_frame(self, fn):
+        """Parse frame fn and decode its assets in the background.
+
+        Returns a Future for the Frame. switch_frame(fn) waits for a pending
+        preload instead of doing the work again."""
+        future = self._preloads.get(fn)
+        if future is None:
+            if self._preload_pool is None:
+                self._preload_pool = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="preload")
+            future = self._preloads[fn] = self._preload_pool.submit(self._preload, fn)
+        return future
+
+    def _preload(self, fn):
+        frame = self.frames[fn]
+        self.preload_assets(frame)
+        return frame
+
     @abc.abstractmethod
     def pre_update(self):
         ...
@@ -143,17 +378,209 @@ class Game(abc.ABC):
 
     @classmethod
     def from_dict(cls, fileloader, d):
-        frames = []
-        for i in d["frames"]:
-            frames.append(Frame.from_dict(i))
-
         game = cls(fileloader)
-        game.frames = frames
+        game.frames = FrameList(d["frames"])
+        for type_name, count in d.get("pools", {}).items():
+            game.prewarm(type_name, count)
         return game
 
+    def prewarm(self, type_name, count):
+        """Recycle destroyed objects of type_name and keep count spare ones ready.
+
+        Only types set up here are pooled. Don't keep references to pooled
+        objects after destroying them, they come back as new objects."""
+        cls = ObjInfo.object_type(type_name)
+        pool = self.pools.setdefault(cls, [])
+        while len(pool) < count:
+            obj = cls(self, self.objs, "", [0, 0])
+            self.objs.remove(obj)
+            pool.append(obj)
+
+    def new_object(self, cls, objs, name, pos):
+        """cls(self, objs, name, pos), reusing a pooled instance if there is one"""
+        pool = self.pools.get(cls)
+        if pool:
+            obj = pool.pop()
+            obj.__init__(self, objs, name, pos)
+            return obj
+        return cls(self, objs, name, pos)
+
+    def recycle(self, obj):
+        """Called for every destroyed object"""
+        if obj.__class__ in self.pools:
+            self._released.append(obj)
+
+    def _pool_released(self):
+        # Deferred to frame boundaries so objects destroyed mid-row are not
+        # handed out again while the row still holds them.
+        for obj in self._released:
+            if not self.objs.duplicates_of(obj):   # Live duplicates still point at it
+                self.pools[obj.__class__].append(obj)
+        self._released.clear()
+
+    def snapshot(self):
+        """Capture the running frame's state as bytes for restore().
+
+        Covers every object's type, name, attributes, duplicate_of link and
+        saved state (see Object.save_states), plus camera, pending triggers
+        and engine_state(). Times are stored relative to now(), so a
+        snapshot restored later resumes its timers where they were. The
+        bytes are in savestate's format, so they can go to disk."""
+        layout = self._snapshot_layout()
+        now = self.now()
+        triggers = self.triggers
+        state = (self.current_frame, self.camerax, self.cameray, self._accumulator, self.engine_state(),
+                 sorted(triggers.pending, key=repr), [(deadline - now, seq, key) for deadline, seq, key in triggers.timers],
+                 triggers.seq, layout.structure,
+                 layout.attributes(),
+                 [cls.save_states(members, layout.index) for cls, members in layout.groups])
+        return savestate.dumps(state)
+
+    def _snapshot_layout(self):
+        # What snapshot() stores about the objects themselves only changes
+        # when they are created, destroyed or relinked, so it is kept
+        # until self.objs changes
+        layout = self._layout
+        if layout is not None and layout.version == self.objs.version:
+            return layout
+
+        objs = list(self.objs)
+        index = {obj: i for i, obj in enumerate(objs)}
+        type_names = {cls: name for name, cls in ObjInfo.OBJ_TYPES.items()}
+        types = {}    # Class -> number in the type table
+        names = {}    # Object name -> number in the name table
+        records = {}
+        owners = []   # First object using each record
+        groups = {}   # Class -> its objects, in order
+        for i, obj in enumerate(objs):
+            if obj.record not in records:
+                records[obj.record] = len(records)
+                owners.append(i)
+            groups.setdefault(obj.__class__, []).append(obj)
+        structure = (array.array("q", [obj.uid for obj in objs]),
+                     array.array("q", [types.setdefault(obj.__class__, len(types)) for obj in objs]),
+                     array.array("q", [names.setdefault(obj.name, len(names)) for obj in objs]),
+                     [type_names[cls] for cls in types], list(names),
+                     array.array("q", [index.get(obj.duplicate_of, -1) for obj in objs]),
+                     array.array("q", [records[obj.record] for obj in objs]),
+                     array.array("q", owners))
+        layout = self._layout = SnapshotLayout(self.objs.version, objs, index, list(records), structure,
+                                               [(cls, groups[cls]) for cls in types])
+        return layout
+
+    def restore(self, blob):
+        """Go back to the state captured by snapshot().
+
+        Live objects the snapshot knows are reused as they are, without
+        init(); objects destroyed since are recreated and revive()d and the
+        ones created since are destroyed. A snapshot taken in another frame
+        clears this one and switch_frame()s to that frame first, so the
+        frame's assets and event grid are loaded. Objects removed by a
+        restore don't end the game, even the Game object. Raises
+        savestate.StateError for anything that isn't a snapshot from this
+        version."""
+        (frame, camerax, cameray, accumulator, engine, pending, timers, seq,
+         structure, attributes, states) = savestate.loads(blob)
+        uids, type_ids, name_ids, type_table, name_table, dups, records, owners = structure
+        if frame != self.current_frame:
+            self.switch_frame(frame)
+        self.camerax = camerax
+        self.cameray = cameray
+        self._accumulator = accumulator
+        self.set_engine_state(engine)
+        now = self.now()
+
+        layout = self._layout
+        if layout is not None and layout.version == self.objs.version and layout.structure[0] == uids:
+            # Nothing created or destroyed since, so types, names, records
+            # and duplicate_of links are all still the same
+            objs = layout.objs
+            groups = layout.groups
+            if layout.attributes() != attributes:
+                for i, d in zip(owners, json.loads(attributes)):
+                    record = objs[i].record
+                    if record.values != d:
+                        record.values.clear()
+                        record.values.update(d)
+        else:
+            types = [ObjInfo.object_type(name) for name in type_table]
+            objs = self._restore_objects(uids.tolist(), [types[i] for i in type_ids],
+                                         [name_table[i] for i in name_ids], dups, records, json.loads(attributes))
+            groups = [(cls, []) for cls in types]
+            for obj, i in zip(objs, type_ids):
+                groups[i][1].append(obj)
+            self._layout = None
+
+        for (cls, members), state in zip(groups, states):
+            cls.load_states(members, state, objs)
+
+        self.triggers.pending = set(pending)
+        self.triggers.timers = [(now + deadline, seq, key) for deadline, seq, key in timers]
+        self.triggers.seq = seq
+        if uids:
+            self._next_uid = max(self._next_uid, max(uids) + 1)
+
+    def _restore_objects(self, uids, classes, names, dups, records, values):
+        # Match the live objects up with the snapshot's, creating the missing
+        # ones and destroying the extra ones, and put them in snapshot order
+        live = {obj.uid: obj for obj in self.objs}
+        shared = [None] * len(values)
+        objs = []
+        revived = []
+        for uid, cls, name, record in zip(uids, classes, names, records):
+            obj = live.pop(uid, None)
+            fresh = obj is None or obj.__class__ is not cls or obj.name != name
+            if fresh:
+                if obj is not None:
+                    live[uid] = obj   # Same uid, different object: gets destroyed below
+                obj = self.new_object(cls, self.objs, name, [0, 0])
+                obj.uid = uid
+                revived.append(obj)
+            if shared[record] is None:
+                # Keep the record the object already shares with its
+                # prototype/ObjInfo, only its values come from the snapshot
+                if fresh:
+                    shared[record] = AttrRecord(values[record])
+                else:
+                    shared[record] = obj.record
+                    if obj.record.values != values[record]:
+                        obj.record.values.clear()
+                        obj.record.values.update(values[record])
+            obj.record = shared[record]
+            objs.append(obj)
+
+        for obj in live.values():
+            self._discard(obj)
+
+        for obj, dup in zip(objs, dups):
+            new = objs[dup] if dup >= 0 else None
+            if obj.duplicate_of is not new:
+                old = obj.duplicate_of
+                obj.duplicate_of = new
+                self.objs.reindex_duplicate(obj, old)
+        for obj in revived:
+            obj.revive()
+        self.objs.reorder(objs)
+        return objs
+
+    def _discard(self, obj):
+        # Destroy obj for a frame change or restored state. That isn't the
+        # game closing, so Exit from on_destroy (the Game object's) is dropped
+        self.objs.remove(obj)
+        try:
+            obj.on_destroy()
+        except Exit:
+            pass
+        self.recycle(obj)
+
     def switch_frame(self, fn):
-        for i in self.objs:
-            i.trigger_action("Destroy")
+        future = self._preloads.pop(fn, None)
+        if future is not None:
+            future.result()
+
+        for i in list(self.objs):
+            self._discard(i)
+        self._pool_released()
 
         self.current_frame = fn
         for objinfo in self.frames[self.current_frame].objs:
@@ -165,6 +592,11 @@ class Game(abc.ABC):
         for objinfo in self.frames[self.current_frame].objs:
             objinfo.fill_attributes()
 
+        self._compile_grid()
+
+    def _compile_grid(self):
+        self.frames[self.current_frame].grid.compile(self.objs, self.triggers, self.profiler)
+
 class Reader(abc.ABC):
 
     def __init__(self, fp):
@@ -178,9 +610,285 @@ class Reader(abc.ABC):
     def get_project_file(self):
         ...
 
+class ObjectSet():
+    """Set of live objects, indexed by name and by the object they duplicate.
+
+    Buckets are insertion-ordered dicts used as ordered sets, so lookups
+    return objects in creation order. Name buckets are never dropped, so a
+    bucket returned by bucket() stays live for the lifetime of the set."""
+
+    __slots__ = ["_objs", "_by_name", "_by_proto", "version"]
+
+    def __init__(self):
+        self._objs = {}
+        self._by_name = {}
+        self._by_proto = {}
+        self.version = 0   # Bumped whenever membership, order or duplicate links change
+
+    def __iter__(self):
+        return iter(self._objs)
+
+    def __len__(self):
+        return len(self._objs)
+
+    def __contains__(self, obj):
+        return obj in self._objs
+
+    def add(self, obj):
+        if obj in self._objs:
+            return
+        self.version += 1
+        self._objs[obj] = None
+        self._by_name.setdefault(obj.name, {})[obj] = None
+        self._index_duplicate(obj)
+
+    def remove(self, obj):
+        del self._objs[obj]   # Raises KeyError just like set.remove
+        self.version += 1
+        del self._by_name[obj.name][obj]
+        self._unindex_duplicate(obj)
+
+    def discard(self, obj):
+        try:
+            self.remove(obj)
+        except KeyError:
+            pass
+
+    def reorder(self, objs):
+        """Make iteration order that of objs, which must hold the same objects"""
+        if list(self._objs) == objs:
+            return
+        self.version += 1
+        self._objs = dict.fromkeys(objs)
+        for bucket in self._by_name.values():   # Cleared in place, compiled rows hold them
+            bucket.clear()
+        self._by_proto.clear()
+        for obj in objs:
+            self._by_name[obj.name][obj] = None
+            self._index_duplicate(obj)
+
+    def by_name(self, name):
+        return self._by_name.get(name, {}).keys()
+
+    def bucket(self, name):
+        """The live {obj: None} dict of objects called name"""
+        return self._by_name.setdefault(name, {})
+
+    def duplicates_of(self, obj):
+        return self._by_proto.get(obj, {}).keys()
+
+    def reindex_duplicate(self, obj, old):
+        """Move obj to the right duplicate bucket after obj.duplicate_of changed"""
+        if obj not in self._objs:
+            return
+        self.version += 1
+        new = obj.duplicate_of
+        obj.duplicate_of = old
+        self._unindex_duplicate(obj)
+        obj.duplicate_of = new
+        self._index_duplicate(obj)
+
+    def _index_duplicate(self, obj):
+        if isinstance(obj.duplicate_of, Object):
+            self._by_proto.setdefault(obj.duplicate_of, {})[obj] = None
+
+    def _unindex_duplicate(self, obj):
+        if isinstance(obj.duplicate_of, Object):
+            bucket = self._by_proto.get(obj.duplicate_of)
+            if bucket is not None:
+                bucket.pop(obj, None)
+                if not bucket:
+                    del self._by_proto[obj.duplicate_of]
+
+class SpatialHash():
+    """Broad-phase grid for box queries.
+
+    Objects are bucketed by name in every cell their box touches. Boxes are
+    inclusive on both ends, matching VisibleObject.check_overlap, so two
+    boxes that only share an edge always share a cell."""
+
+    __slots__ = ["cell_size", "cells", "ranges"]
+
+    def __init__(self, cell_size=32):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.ranges = {}
+
+    def _range(self, x0, y0, x1, y1):
+        cs = self.cell_size
+        return (int(x0 // cs), int(y0 // cs), int(x1 // cs), int(y1 // cs))
+
+    def move(self, obj, x0, y0, x1, y1):
+        """Insert obj, or update its box if it is already present"""
+        new = self._range(x0, y0, x1, y1)
+        old = self.ranges.get(obj)
+        if old == new:
+            return
+        if old is not None:
+            self._unlink(obj, old)
+        self.ranges[obj] = new
+        cx0, cy0, cx1, cy1 = new
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                self.cells.setdefault((cx, cy), {}).setdefault(obj.name, {})[obj] = None
+
+    def remove(self, obj):
+        old = self.ranges.pop(obj, None)
+        if old is not None:
+            self._unlink(obj, old)
+
+    def query(self, name, x0, y0, x1, y1):
+        """Objects called name whose cells overlap the box, in no particular order"""
+        cx0, cy0, cx1, cy1 = self._range(x0, y0, x1, y1)
+        cells = self.cells
+        if cx0 == cx1 and cy0 == cy1:
+            bucket = cells.get((cx0, cy0))
+            if bucket is None:
+                return []
+            return list(bucket.get(name, ()))
+
+        res = {}
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                bucket = cells.get((cx, cy))
+                if bucket is not None and name in bucket:
+                    res.update(bucket[name])
+        return list(res)
+
+    def _unlink(self, obj, rng):
+        cx0, cy0, cx1, cy1 = rng
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cell = self.cells[cx, cy]
+                bucket = cell[obj.name]
+                del bucket[obj]
+                if not bucket:
+                    del cell[obj.name]
+                    if not cell:
+                        del self.cells[cx, cy]
+
+class AssetCache():
+    """Reference counted asset cache.
+
+    Assets nobody references are kept around for reuse and evicted least
+    recently released first once the cache holds more than budget bytes."""
+
+    __slots__ = ["budget", "entries", "keys", "unused", "nbytes"]
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.entries = {}                       # key -> [asset, refs, nbytes]
+        self.keys = {}                          # id(asset) -> key
+        self.unused = collections.OrderedDict() # keys with refs == 0, LRU first
+        self.nbytes = 0
+
+    def get(self, key, load, sizeof):
+        """Return the asset for key, calling load() on a miss. Adds a reference"""
+        entry = self.entries.get(key)
+        if entry is None:
+            asset = load()
+            entry = [asset, 0, sizeof(asset)]
+            self.entries[key] = entry
+            self.keys[id(asset)] = key
+            self.nbytes += entry[2]
+        elif entry[1] == 0:
+            del self.unused[key]
+
+        entry[1] += 1
+        self.evict()
+        return entry[0]
+
+    def put(self, key, asset, nbytes):
+        """Add an asset nobody references yet; it counts against the budget
+        and is evicted like a released one"""
+        if key in self.entries:
+            return
+        self.entries[key] = [asset, 0, nbytes]
+        self.keys[id(asset)] = key
+        self.unused[key] = None
+        self.nbytes += nbytes
+        self.evict()
+
+    def take(self, key):
+        """Remove an unreferenced asset and return it, None if not cached"""
+        entry = self.entries.get(key)
+        if entry is None or entry[1]:
+            return None
+        del self.entries[key]
+        del self.keys[id(entry[0])]
+        del self.unused[key]
+        self.nbytes -= entry[2]
+        return entry[0]
+
+    def key_of(self, asset):
+        return self.keys.get(id(asset))
+
+    def in_use(self):
+        """(key, asset) pairs that are referenced at least once"""
+        return [(key, entry[0]) for key, entry in self.entries.items() if entry[1]]
+
+    def release(self, asset):
+        key = self.keys.get(id(asset))
+        if key is None:
+            return
+        entry = self.entries[key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            self.unused[key] = None
+            self.evict()
+
+    def evict(self):
+        while self.nbytes > self.budget and self.unused:
+            key, _ = self.unused.popitem(last=False)
+            asset, _, nbytes = self.entries.pop(key)
+            del self.keys[id(asset)]
+            self.nbytes -= nbytes
+
+    def clear(self):
+        self.entries.clear()
+        self.keys.clear()
+        self.unused.clear()
+        self.nbytes = 0
+
+class Triggers():
+    """Pending push-based events.
+
+    Event types that only fire when something changes (see
+    Object.event_trigger) get a hashable trigger key. Whatever makes the
+    change fires the key, and a compiled EventGrid only evaluates those rows
+    once their key is pending. Keys fired during a grid tick are seen by the
+    next one."""
+
+    __slots__ = ["pending", "timers", "seq"]
+
+    def __init__(self):
+        self.pending = set()
+        self.timers = []    # Heap of (deadline, seq, key)
+        self.seq = 0
+
+    def fire(self, key):
+        self.pending.add(key)
+
+    def schedule(self, deadline, key):
+        """Fire key on the first poll after deadline"""
+        heapq.heappush(self.timers, (deadline, self.seq, key))
+        self.seq += 1
+
+    def poll(self, now):
+        timers = self.timers
+        while timers and timers[0][0] < now:
+            self.pending.add(heapq.heappop(timers)[2])
+
+    def take(self):
+        pending = self.pending
+        self.pending = set()
+        return pending
+
 class ObjInfo():
 
     OBJ_TYPES = {}
+    TYPE_MODULES = {}    # Type name -> module that registers it, imported on first use
+    import_time = 0.0    # Seconds spent importing TYPE_MODULES so far
     __slots__ = ["name", "pos", "type", "attrib", "duplicate_of", "obj"]
 
     def __init__(self, type, name, pos, attrib):
@@ -199,8 +907,26 @@ class ObjInfo():
     def register_object_type(name, type):
         ObjInfo.OBJ_TYPES[name] = type
 
+    @staticmethod
+    def register_type_modules(manifest):
+        """Make types loadable by name without importing them yet"""
+        ObjInfo.TYPE_MODULES.update(manifest)
+
+    @staticmethod
+    def object_type(name):
+        cls = ObjInfo.OBJ_TYPES.get(name)
+        if cls is None:
+            module = ObjInfo.TYPE_MODULES.get(name)
+            if module is None:
+                raise KeyError(name)
+            start = time.perf_counter()
+            importlib.import_module(module)
+            ObjInfo.import_time += time.perf_counter() - start
+            cls = ObjInfo.OBJ_TYPES[name]
+        return cls
+
     def create_object(self, game, objs):
-        obj = ObjInfo.OBJ_TYPES[self.type](game, objs, self.name, self.pos)
+        obj = game.new_object(ObjInfo.object_type(self.type), objs, self.name, self.pos)
         self.obj = obj
         obj.duplicate_of = self.duplicate_of
         return obj
@@ -208,45 +934,96 @@ class ObjInfo():
     def fill_attributes(self):
         self.obj.fill_attributes(self.attrib)
 
+class SnapshotLayout():
+    """Per-object part of Game.snapshot, valid while objs.version is version"""
+
+    __slots__ = ["version", "objs", "index", "records", "structure", "groups", "_values", "_json"]
+
+    def __init__(self, version, objs, index, records, structure, groups):
+        self.version = version
+        self.objs = objs
+        self.index = index
+        self.records = records
+        self.structure = structure
+        self.groups = groups   # [(class, its objects)] in type table order
+        self._values = None
+        self._json = None
+
+    def attributes(self):
+        """Every record's values as JSON, which they come from anyway.
+        Re-encoded only when they changed since the last call"""
+        values = [record.values for record in self.records]
+        if values != self._values:
+            self._values = [dict(d) for d in values]
+            self._json = json.dumps(values)
+        return self._json
+
+class AttrRecord():
+    """Attributes of a prototype, shared by reference with its duplicates"""
+
+    __slots__ = ["values"]
+
+    def __init__(self, values):
+        self.values = values
+
 class Object(abc.ABC):
 
     ATTRUBUTE_NAMES = []
     # Editor stuff
     ACTIONS = [("Destroy",)]
     EVENTS = []
+
+    # Subclasses that declare __slots__ too stay dict-free; see baseobjects
+    __slots__ = ["game", "name", "pos", "objs", "duplicate_of", "record", "uid"]
     
     def __init__(self, game, objs, name, pos):
+        self.uid = game._next_uid   # Identifies the object in Game.snapshot
+        game._next_uid += 1
         self.game = game
         self.name = name
         self.pos = pos
         self.objs = objs
         self.duplicate_of = None
-        self.attrs = {}
+        self.record = AttrRecord({})
         self.objs.add(self)
 
+    @property
+    def attrs(self):
+        return self.record.values
+
+    @attrs.setter
+    def attrs(self, d):
+        self.record.values = d
+
     @abc.abstractmethod
     def tick(self):
         ...
 
+    def draw(self):
+        """Queue blits for this frame. Separate from tick() so several
+        logic steps can run per rendered frame"""
+
     @abc.abstractmethod
     def init(self):
         ...
 
     def update_duplicate(self):
         if self.duplicate_of is not None:
+            old = self.duplicate_of
             self.duplicate_of = self.duplicate_of.obj
+            self.objs.reindex_duplicate(self, old)
+
+            # Share the record of the end of the duplicate_of chain. The
+            # prototype may not be filled yet, but it fills this same record.
+            while old.duplicate_of is not None:
+                old = old.duplicate_of
+            self.record = old.obj.record
 
     def getattr(self, x):
-        if self.duplicate_of is None:
-            return self.attrs[x]
-        else:
-            return self.duplicate_of.getattr(x)
+        return self.record.values[x]
 
     def setattr(self, x, y):
-        if self.duplicate_of is None:
-            self.attrs[x] = y
-        else:
-            self.duplicate_of.setattr(x, y)
+        self.record.values[x] = y
 
     def is_duplicate(self, obj):
         return self.duplicate_of is obj
@@ -259,6 +1036,7 @@ class Object(abc.ABC):
                 pass
             else:
                 self.on_destroy()
+                self.game.recycle(self)
         else:
             self.handle_action(name, arg)
 
@@ -273,6 +1051,53 @@ class Object(abc.ABC):
 
     def on_destroy(self):
         ...
+
+    def save_state(self, index):
+        """Values (savestate-encodable) Game.snapshot keeps for this object.
+
+        index maps live objects to the numbers load_state gets them back by."""
+        return None
+
+    def load_state(self, state, objs):
+        """Set the state from save_state; objs[i] is the object numbered i"""
+
+    @classmethod
+    def save_states(cls, objs, index):
+        """State of all of objs, which are exactly of this class, for
+        Game.snapshot. Collects save_state() by default; types with many
+        instances return one packed array instead"""
+        return [obj.save_state(index) for obj in objs]
+
+    @classmethod
+    def load_states(cls, objs, states, all_objs):
+        """Counterpart of save_states"""
+        for obj, state in zip(objs, states):
+            obj.load_state(state, all_objs)
+
+    def revive(self):
+        """Called when Game.restore brings back a destroyed object, after its
+        attributes are set and instead of init()"""
+
+    @classmethod
+    def compile_event(cls, name, arg):
+        """Return f(obj) that does obj.check_event(name, arg).
+
+        Subclasses resolve the event name once here instead of on every call."""
+        return lambda obj: obj.check_event(name, arg)
+
+    @classmethod
+    def event_trigger(cls, name, arg):
+        """Trigger key that is fired whenever this event may become true.
+
+        None (the default) means the event has to be polled every frame."""
+        return None
+
+    @classmethod
+    def compile_action(cls, name, arg):
+        """Return f(obj) that does obj.trigger_action(name, arg)"""
+        if name == "Destroy":
+            return lambda obj: obj.trigger_action(name, arg)
+        return lambda obj: obj.handle_action(name, arg)
     
     @abc.abstractmethod
     def handle_action(self, name, arg):
@@ -313,11 +1138,21 @@ class Action():
 
 class EventGrid():
 
-    __slots__ = ["grid"]
+    __slots__ = ["grid", "rows", "rows_objs", "triggers"]
     def __init__(self):
         self.grid = {}
+        self.rows = []
+        self.rows_objs = None
+        self.triggers = None
 
     def tick(self, objs):
+        if self.rows_objs is objs:
+            pending = self.triggers.take() if self.triggers is not None else ()
+            for trigger, row in self.rows:
+                if trigger is None or trigger in pending:
+                    row()
+            return
+
         for event in self.grid:
             for obj in self.find_objects(objs, event.objname):
                 related = obj.check_event(event.name, event.arg)
@@ -329,23 +1164,84 @@ class EventGrid():
 
     def find_objects(self, objs, name, related=None):
         # TODO: VERIFY THIS LOGIC
+        # Always returns a fresh list, actions may create/destroy objects
+        # while the caller is still iterating over the result.
         if related is None:
-            return [i for i in objs if i.name == name]
+            return list(objs.by_name(name))
         else:
-            res = []
-            if related[0].name == name:
-                res.append(related[0])
-            if len(related) > 1:
-                if related[1].name == name:
-                    res.append(related[1])
-            for i in objs:
-                if i.name == name and (not i.is_duplicate(related[0])) and (i != related[0]):
+            return self._find_related(objs, objs.by_name(name), name, related)
+
+    @staticmethod
+    def _find_related(objs, candidates, name, related):
+        res = []
+        if related[0].name == name:
+            res.append(related[0])
+        if len(related) > 1:
+            if related[1].name == name:
+                res.append(related[1])
+        if candidates:
+            skip = objs.duplicates_of(related[0])
+            for i in candidates:
+                if i not in skip and i is not related[0]:
                     res.append(i)
-            if len(res) == 0:
-                for i in objs:
-                    if i.name == related[0].name:
-                        res.append(i)
-            return res
+        if len(res) == 0:
+            res.extend(objs.by_name(related[0].name))
+        return res
+
+    def compile(self, objs, triggers=None, profiler=None):
+        """Turn every row into a closure bound to objs, used by tick(objs) from now on.
+
+        Object name lookups resolve to live ObjectSet buckets and event/action
+        names to handlers from compile_event/compile_action, once per class.
+        With triggers, rows whose event has a trigger key only run when that
+        key is pending. With a profiler, every row, check and action is
+        wrapped to record counts and timings."""
+        self.rows = [(self._row_trigger(objs, event) if triggers is not None else None,
+                      self._compile_row(objs, event, actions, profiler, i))
+                     for i, (event, actions) in enumerate(self.grid.items())]
+        self.rows_objs = objs
+        self.triggers = triggers
+
+    @staticmethod
+    def _row_trigger(objs, event):
+        # Only push-based if every object the row can see right now agrees;
+        # an empty bucket may later be filled by anything, so poll it.
+        classes = {obj.__class__ for obj in objs.by_name(event.objname)}
+        if len(classes) != 1:
+            return None
+        return classes.pop().event_trigger(event.name, event.arg)
+
+    def _compile_row(self, objs, event, actions, profiler=None, index=0):
+        find_related = self._find_related
+        label = "#%d %s: %s %r" % (index, event.objname, event.name, event.arg)
+        sources = objs.bucket(event.objname)
+        checks = {}   # class -> compiled event
+        targets = [(objs.bucket(action.objname), action.objname, action.name, action.value, {})
+                   for action in actions]
+
+        def row():
+            for obj in list(sources):
+                check = checks.get(obj.__class__)
+                if check is None:
+                    check = obj.compile_event(event.name, event.arg)
+                    if profiler is not None:
+                        check = profiler.wrap_event(label, check)
+                    checks[obj.__class__] = check
+                related = check(obj)
+                if related:
+                    for bucket, objname, name, value, handlers in targets:
+                        for aobj in find_related(objs, bucket, objname, related):
+                            handler = handlers.get(aobj.__class__)
+                            if handler is None:
+                                handler = aobj.compile_action(name, value)
+                                if profiler is not None:
+                                    handler = profiler.wrap_action("%s: %s" % (objname, name), handler)
+                                handlers[aobj.__class__] = handler
+                            handler(aobj)
+
+        if profiler is not None:
+            return profiler.wrap_row(label, row)
+        return row
 
     @classmethod
     def from_dict(cls, d):
@@ -353,6 +1249,13 @@ class EventGrid():
         grid.grid = {Event.from_dict(event): [Action.from_dict(action) for action in actions] for event, actions in d}
         return grid
 
+def parse_sound(value):
+    """(path, priority) from a "Play sound" value, "path" or ["path", priority]"""
+    if isinstance(value, str):
+        return value, 0
+    path, priority = value
+    return path, priority
+
 def register(name):
     def decorator(f):
         nonlocal name
@@ -0,0 +1,255 @@
+import io
+import struct
+import time
+import mmfbase
+
+# Headless rendering engine: nothing is drawn, input is injected through
+# set_axis/press/release and the clock is simulated, so game logic runs
+# as fast as the CPU allows. Any number of instances can exist at once.
+#
+# Registers its own "Input" type, so don't import it next to mmfpygame in
+# the same process.
+
+class NullImage():
+
+    __slots__ = ["width", "height"]
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+    def get_width(self):
+        return self.width
+
+    def get_height(self):
+        return self.height
+
+    def get_size(self):
+        return (self.width, self.height)
+
+class NullSound():
+
+    __slots__ = ["path"]
+
+    def __init__(self, path):
+        self.path = path
+
+    def play(self, *args):
+        pass
+
+    def stop(self):
+        pass
+
+class NullDisplay():
+
+    __slots__ = ["blits"]
+
+    def __init__(self):
+        self.blits = 0     # Draw calls in the current frame
+
+    def blit(self, img, pos):
+        self.blits += 1
+
+JPEG_SOF = {0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf}   # Frame header markers
+
+def image_size(data):
+    """Width and height from a PNG, GIF, BMP or JPEG header. The first 32
+    bytes are enough except for JPEG, which needs everything up to its
+    frame header"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return struct.unpack(">II", data[16:24])
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return struct.unpack("<HH", data[6:10])
+    if data[:2] == b"BM":
+        width, height = struct.unpack("<ii", data[18:26])
+        return width, abs(height)
+    if data[:2] == b"\xff\xd8":
+        return jpeg_size(data)
+    raise ValueError("Unknown image format")
+
+def jpeg_size(data):
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xff:
+            raise ValueError("Corrupt JPEG")
+        marker = data[offset + 1]
+        if marker == 0xff:              # Fill byte
+            offset += 1
+        elif marker == 0x01 or 0xd0 <= marker <= 0xd8:   # No length
+            offset += 2
+        elif marker in JPEG_SOF:
+            height, width = struct.unpack(">HH", data[offset + 5:offset + 9])
+            return width, height
+        else:
+            offset += 2 + struct.unpack(">H", data[offset + 2:offset + 4])[0]
+    raise ValueError("No frame header in JPEG")
+
+class Game(mmfbase.Game):
+
+    FPS = 60    # Simulated frame rate, None to use real elapsed time
+
+    def init(self):
+        self.display = NullDisplay()
+        self.frame_count = 0
+        self.max_frames = None     # Raise Exit after this many frames
+        self.axes = {}
+        self.keys = set()
+        self._time = 0.0
+        self._dt = 0.0
+        self._last = None
+        self._sizes = {}
+
+    def exit(self):
+        pass
+
+    def pre_update(self):
+        if self.max_frames is not None and self.frame_count >= self.max_frames:
+            raise mmfbase.Exit
+        self.frame_count += 1
+
+        if self.FPS is None:
+            now = time.perf_counter()
+            self._dt = 0.0 if self._last is None else now - self._last
+            self._last = now
+        else:
+            self._dt = 1 / self.FPS
+        self._time += self._dt
+        self.display.blits = 0
+
+    def post_update(self):
+        pass
+
+    def image_load(self, path):
+        size = self._sizes.get(path)
+        if size is None:
+            size = self._sizes[path] = self._image_size(path)
+        return NullImage(*size)
+
+    def _image_size(self, path):
+        f = self.fileloader.get_file(path)
+        if isinstance(f, str):
+            with open(f, "rb") as fp:
+                data = fp.read(32)
+                if data[:2] == b"\xff\xd8":
+                    data += fp.read()
+        else:
+            data = bytes(f[:32])
+            if data[:2] == b"\xff\xd8":
+                data = bytes(f)
+        try:
+            return image_size(data)
+        except ValueError:
+            pass
+
+        # TGA and anything else pygame can read, if it is installed
+        try:
+            import pygame
+        except ImportError:
+            raise ValueError("Unknown image format in %s (pygame reads more formats)" % path)
+        if isinstance(f, str):
+            return pygame.image.load(f).get_size()
+        return pygame.image.load(io.BytesIO(f), path).get_size()
+
+    def image_scale(self, img, x, y):
+        return NullImage(img.get_width() * x, img.get_height() * y)
+
+    def sfx_load(self, path):
+        return NullSound(path)
+
+    def mus_play(self, path):
+        pass
+
+    def get_axis(self, axis):
+        if type(axis) != int:
+            raise TypeError
+        return self.axes.get(axis, 0)
+
+    def get_time(self):
+        return self._dt
+
+    def now(self):
+        return self._time
+
+    def engine_state(self):
+        return (self.frame_count, self._time, self._dt, self.axes, tuple(sorted(self.keys)))
+
+    def set_engine_state(self, state):
+        self.frame_count, self._time, self._dt, axes, keys = state
+        self.axes = dict(axes)
+        self.keys = set(keys)
+
+    # Input injection
+    def set_axis(self, axis, value):
+        self.axes[axis] = value
+
+    def press(self, key):
+        self.keys.add(key)
+
+    def release(self, key):
+        self.keys.discard(key)
+
+
+@mmfbase.register("Input")
+class Input(mmfbase.Object):
+
+    ATTRIBUTE_NAMES = mmfbase.Object.ATTRUBUTE_NAMES
+    EVENTS = mmfbase.Object.EVENTS + [("Key pressed", str), ("Key released", str)]
+    ACTIONS = mmfbase.Object.ACTIONS
+
+    __slots__ = ["last_pressed", "pressed"]
+
+    # Keys are whatever the project and Game.press use, e.g. "ESC"
+
+    def init(self):
+        self.last_pressed = frozenset(self.game.keys)
+        self.pressed      = self.last_pressed
+
+    def tick(self):
+        self.last_pressed = self.pressed
+        self.pressed = frozenset(self.game.keys)
+
+        for key in self.pressed - self.last_pressed:
+            self.game.triggers.fire(("Key pressed", key))
+        for key in self.last_pressed - self.pressed:
+            self.game.triggers.fire(("Key released", key))
+
+    def save_state(self, index):
+        return (tuple(sorted(self.last_pressed)), tuple(sorted(self.pressed)))
+
+    def load_state(self, state, objs):
+        self.last_pressed = frozenset(state[0])
+        self.pressed = frozenset(state[1])
+
+    def check_event(self, name, arg):
+        if name == "Key pressed":
+            return self.key_pressed(arg)
+
+        elif name == "Key released":
+            return self.key_released(arg)
+
+    def handle_action(self, name, value):
+        ...
+
+    @classmethod
+    def event_trigger(cls, name, arg):
+        if name in ("Key pressed", "Key released"):
+            return (name, arg)
+        return super().event_trigger(name, arg)
+
+    @classmethod
+    def compile_event(cls, name, arg):
+        if name == "Key pressed":
+            return lambda obj: obj.key_pressed(arg)
+        elif name == "Key released":
+            return lambda obj: obj.key_released(arg)
+        return super().compile_event(name, arg)
+
+    def key_pressed(self, key):
+        if key not in self.last_pressed and key in self.pressed:
+            return [self]
+        return None
+
+    def key_released(self, key):
+        if key in self.last_pressed and key not in self.pressed:
+            return [self]
+        return None
@@ -1,6 +1,11 @@
+import io
+import math
 import time
+import threading
+import concurrent.futures
 import pygame
 import mmfbase
+import replay
 
 class FakeDisplay():
 
@@ -11,27 +16,171 @@ class FakeDisplay():
     def blit(self, img, pos):
         self.images.append((img, pos))
 
+class InputSnapshot():
+    """Input state sampled once per frame in Game.pre_update.
+
+    axes holds the value of every AxisNames slot, pressed/released the keys
+    that went down/up since the previous snapshot. taken is set once a logic
+    step has seen the edges."""
+
+    __slots__ = ["events", "keys", "axes", "pressed", "released", "taken"]
+
+    def __init__(self, events, keys, axis_keys):
+        self.events = events
+        self.keys = keys
+        self.axes = dict.fromkeys(range(mmfbase.AxisNames.P4_FIRE4 + 1), 0)
+        for axis, (positive, negative) in axis_keys.items():
+            self.axes[axis] = int(any(keys[k] for k in positive)) - int(any(keys[k] for k in negative))
+        self.pressed = frozenset(e.key for e in events if e.type == pygame.KEYDOWN)
+        self.released = frozenset(e.key for e in events if e.type == pygame.KEYUP)
+        self.taken = False
+
+    @classmethod
+    def replayed(cls, axes, pressed, released):
+        """Snapshot from recorded values instead of the keyboard"""
+        snapshot = cls([], None, {})
+        snapshot.axes.update(axes)
+        snapshot.pressed = pressed
+        snapshot.released = released
+        return snapshot
+
+def pack_atlases(images, max_size):
+    """Shelf-pack images into as few surfaces as possible.
+
+    Returns {image: (atlas surface, area rect)}. Opaque and per-pixel alpha
+    images go to separate atlases so opaque sprites keep their fast blit.
+    Images larger than max_size in either direction are left out."""
+    res = {}
+    opaque = [img for img in images if not img.get_flags() & pygame.SRCALPHA]
+    alpha = [img for img in images if img.get_flags() & pygame.SRCALPHA]
+    for group, has_alpha in [(opaque, False), (alpha, True)]:
+        for w, h, placed in _shelf_pack(group, max_size):
+            if has_alpha:
+                atlas = pygame.Surface((w, h), pygame.SRCALPHA).convert_alpha()
+                atlas.fill((0, 0, 0, 0))
+            else:
+                atlas = pygame.Surface((w, h)).convert()
+            for img, x, y in placed:
+                atlas.blit(img, (x, y))
+                res[img] = (atlas, pygame.Rect(x, y, img.get_width(), img.get_height()))
+    return res
+
+def _shelf_pack(images, max_size):
+    pages = []    # [(width, height, [(image, x, y)])]
+    placed = []
+    x = y = shelf_h = page_w = 0
+    for img in sorted(images, key=lambda i: i.get_height(), reverse=True):
+        w, h = img.get_size()
+        if w > max_size or h > max_size:
+            continue
+        if x + w > max_size:
+            x, y, shelf_h = 0, y + shelf_h, 0
+        if y + h > max_size:
+            pages.append((page_w, y + shelf_h, placed))
+            placed = []
+            x = y = shelf_h = page_w = 0
+        placed.append((img, x, y))
+        x += w
+        shelf_h = max(shelf_h, h)
+        page_w = max(page_w, x)
+    if placed:
+        pages.append((page_w, y + shelf_h, placed))
+    return pages
+
 class Game(mmfbase.Game):
 
+    FPS = 60                         # Render rate cap, None for uncapped
+    ASSET_BUDGET = 64 * 1024 * 1024  # Bytes of decoded images/sounds to keep cached
+    ATLAS = False                    # Pack each frame's sprites into atlas surfaces
+    ATLAS_SIZE = 2048
+    REPORT_TIMINGS = False           # Print frame load and blit times
+    STATIC_LAYER = False             # Pre-render static sprites into cached chunks
+    CHUNK_SIZE = 512
+    DIRTY_RECTS = False              # Only redraw what changed since the last frame
+    DIRTY_LIMIT = 64                 # More damaged rects than this means a full redraw
+    CHANNELS = 8                     # Mixer channels sound effects share
+
+    # AxisNames slot -> (keys for +1, keys for -1)
+    AXIS_KEYS = {
+        mmfbase.AxisNames.P1_VERTICAL:   ((pygame.K_w, pygame.K_UP), (pygame.K_s, pygame.K_DOWN)),
+        mmfbase.AxisNames.P1_HORIZONTAL: ((pygame.K_d, pygame.K_RIGHT), (pygame.K_a, pygame.K_LEFT)),
+    }
+
     def init(self):
         if pygame.display.get_init():
             raise RuntimeError("Only one instance of mmfpygame.Game allowed at one time.")
         
         self._display = pygame.display.set_mode((800, 600))
-        self._events = []
+        self.input = InputSnapshot([], pygame.key.get_pressed(), self.AXIS_KEYS)
         self._clock = pygame.time.Clock()
+        self._dt = 0.0             # Length of the current frame, see get_time
+        self._time = 0.0           # Sum of frame times, see now
+        self._recorder = None      # replay.Recorder while recording
+        self._player = None        # replay.Player while replaying
+        self._verify = False
+        self._assets = mmfbase.AssetCache(self.ASSET_BUDGET)
+        try:
+            pygame.mixer.init()
+        except pygame.error:
+            pass                   # No audio device, sounds are skipped
+        self._audio = pygame.mixer.get_init() is not None
+        if self._audio:
+            pygame.mixer.set_num_channels(self.CHANNELS)
+        self._channels = [pygame.mixer.Channel(i) for i in range(self.CHANNELS)] if self._audio else []
+        self._voices = [(0, 0)] * len(self._channels)   # (priority, play order) of what each channel plays
+        self._voice_count = 0
+        self._bank = {}            # Path -> sound, decoded when a frame loads
+        self._preloaded_sfx = {}   # Path -> sound decoded by preload_assets, until _adopt_preloads
+        self._music_pool = None    # Single worker thread that opens music
+        self._music_request = 0
+        self._music_source = None  # Buffer the music streams from, kept alive while it plays
+        self._atlas = {}
+        self._preloaded = {}       # Sprite name -> surface decoded by preload_assets, until _adopt_preloads
+        self._preload_lock = threading.Lock()
+        self._commands = []        # Surface.blits buffer, reused between frames
+        self._last_draws = set()   # DIRTY_RECTS: what was on screen last frame
+        self._last_camera = None   # None forces a full redraw
+        self._chunks = {}          # STATIC_LAYER: (cx, cy) -> [{obj: (img, pos)}, surface or None]
+        self._static_chunks = {}   # obj -> chunk keys it is drawn into
         self.display = FakeDisplay(self._display)
+        self.load_time = 0.0       # Seconds spent in the last switch_frame
+        self.blit_time = 0.0       # Seconds spent blitting in the last post_update
+        self._blit_total = 0.0
+        self._blit_frames = 0
 
     def exit(self):
+        if self._recorder is not None:
+            self._recorder.close()
+        if self._music_pool is not None:
+            self._music_pool.shutdown(wait=True)
+        self._assets.clear()
         pygame.display.quit()
         pygame.mixer.quit()
         pygame.quit()
 
     def pre_update(self):
-        self._clock.tick(60)
-        self._display.fill(0)
+        self._adopt_preloads()
+        if self._player is not None:
+            self._replay_frame()
+            return
+
+        self._clock.tick(self.FPS or 0)
+        if not self.DIRTY_RECTS:
+            self._display.fill(0)
         
-        self._events = []
+        events = self._pump_events()
+        if self._recorder is not None:
+            # Before now() moves on, as in _replay_frame
+            state = replay.state_hash(self) if self._recorder.hash_due() else 0
+        snapshot = InputSnapshot(events, pygame.key.get_pressed(), self.AXIS_KEYS)
+        self._dt = self._clock.get_time() / 1000
+        self._time += self._dt
+        if self._recorder is not None:
+            self._recorder.write(self._dt, state, snapshot)
+        self.input = self._carry_edges(snapshot)
+
+    def _pump_events(self):
+        events = []
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 pygame.display.quit()
@@ -39,54 +188,361 @@ class Game(mmfbase.Game):
                 pygame.quit()
                 raise mmfbase.Exit
             else:
-                self._events.append(event)
+                events.append(event)
+        return events
+
+    def _replay_frame(self):
+        # Like pre_update, but time and input come from the recording and
+        # nothing waits for the frame rate cap
+        if self.render and not self.DIRTY_RECTS:
+            self._display.fill(0)
+        self._pump_events()   # Keeps the window responsive, input is ignored
+
+        frame = self._player.next_frame()
+        if frame is None:
+            raise mmfbase.Exit
+        dt, state, axes, pressed, released = frame
+        if self._verify and state is not None and replay.state_hash(self) != state:
+            raise replay.DesyncError("Game state differs from the recording at frame %d" % (self._player.frame - 1))
+        self._dt = dt
+        self._time += dt
+        self.input = self._carry_edges(InputSnapshot.replayed(axes, pressed, released))
+
+    def _carry_edges(self, snapshot):
+        # With tick_rate below the frame rate some frames run no logic step.
+        # Key edges of those frames go to the next snapshot instead of being
+        # dropped, until a step takes them.
+        last = self.input
+        if not last.taken:
+            snapshot.pressed = snapshot.pressed | last.pressed
+            snapshot.released = snapshot.released | last.released
+        return snapshot
+
+    def enable_recording(self, path, hash_interval=1):
+        """Log every frame's input and frame time to path, see replay.py.
+
+        A state hash to check replays against is taken every hash_interval
+        frames; raise it if hashing large levels every frame costs too much.
+        tick_rate, max_steps and batch mode are saved with the recording, so
+        set them first"""
+        self._recorder = replay.Recorder(path, hash_interval, self.tick_rate, self.max_steps, self.batch is not None)
+
+    def enable_replay(self, path, verify=True):
+        """Play back a recording from enable_recording at full speed.
+
+        With verify, raises replay.DesyncError as soon as the game state
+        differs from the recorded one. Uses the recording's tick_rate,
+        max_steps and batch mode; call before run(). Returns the
+        replay.Player"""
+        player = replay.Player(path)
+        if self.batch is not None and not player.batch:
+            raise ValueError("%s was recorded without batch mode" % path)
+        self.tick_rate = player.tick_rate
+        self.max_steps = player.max_steps
+        if player.batch and self.batch is None:
+            self.enable_batch()
+        self._player = player
+        self._verify = verify
+        return player
 
     def post_update(self):
-        for i in self.display.images:
-            self._display.blit(i[0], (i[1][0] - self.camerax, i[1][1] - self.cameray))
-
-        self.display.images = []
-        pygame.display.flip()
+        start = time.perf_counter()
+        atlas = self._atlas
+        commands = self._commands
+        screen_w, screen_h = self._display.get_size()
+        # Whole pixels, once, so chunks and sprites shift by the same amount
+        # when the camera follows a fractional position
+        camerax = math.floor(self.camerax)
+        cameray = math.floor(self.cameray)
+        n = 0
+        if self._chunks:
+            cs = self.CHUNK_SIZE
+            for cy in range(int(cameray // cs), int((cameray + screen_h - 1) // cs) + 1):
+                for cx in range(int(camerax // cs), int((camerax + screen_w - 1) // cs) + 1):
+                    chunk = self._chunks.get((cx, cy))
+                    if chunk is None:
+                        continue
+                    if chunk[1] is None:
+                        chunk[1] = self._render_chunk(cx, cy, chunk[0])
+                    cmd = (chunk[1], (cx * cs - camerax, cy * cs - cameray))
+                    if n < len(commands):
+                        commands[n] = cmd
+                    else:
+                        commands.append(cmd)
+                    n += 1
+
+        for img, pos in self.display.images:
+            x = pos[0] - camerax
+            y = pos[1] - cameray
+            w, h = img.get_size()
+            if x >= screen_w or y >= screen_h or x + w <= 0 or y + h <= 0:
+                continue   # Off screen
+
+            sub = atlas.get(img)
+            if sub is None:
+                cmd = (img, (x, y))
+            else:
+                cmd = (sub[0], (x, y), sub[1])
+            if n < len(commands):
+                commands[n] = cmd
+            else:
+                commands.append(cmd)
+            n += 1
+        del commands[n:]
+
+        if self.DIRTY_RECTS:
+            self._present_dirty(commands)
+        else:
+            self._display.blits(commands, doreturn=False)
+            pygame.display.flip()
+        self.blit_time = time.perf_counter() - start
+
+        self.display.images.clear()
+
+        if self.REPORT_TIMINGS:
+            self._blit_total += self.blit_time
+            self._blit_frames += 1
+            if self._blit_frames == 60:
+                print("Blit: %.3f ms/frame" % (self._blit_total / 60 * 1000))
+                self._blit_total = 0.0
+                self._blit_frames = 0
+
+    def static_update(self, obj, img, pos):
+        if not self.STATIC_LAYER:
+            return False
+
+        self.static_remove(obj)
+        cs = self.CHUNK_SIZE
+        keys = []
+        for cy in range(int(pos[1] // cs), int((pos[1] + img.get_height() - 1) // cs) + 1):
+            for cx in range(int(pos[0] // cs), int((pos[0] + img.get_width() - 1) // cs) + 1):
+                chunk = self._chunks.setdefault((cx, cy), [{}, None])
+                chunk[0][obj] = (img, pos)
+                chunk[1] = None
+                keys.append((cx, cy))
+        self._static_chunks[obj] = keys
+        return True
+
+    def static_remove(self, obj):
+        for key in self._static_chunks.pop(obj, ()):
+            chunk = self._chunks[key]
+            del chunk[0][obj]
+            if chunk[0]:
+                chunk[1] = None
+            else:
+                del self._chunks[key]
+
+    def _render_chunk(self, cx, cy, members):
+        # Static sprites are the bottom layer, so an opaque black chunk
+        # looks the same as the cleared screen underneath it.
+        cs = self.CHUNK_SIZE
+        surf = pygame.Surface((cs, cs)).convert()
+        surf.fill(0)
+        surf.blits([(img, (pos[0] - cx * cs, pos[1] - cy * cs)) for img, pos in members.values()], doreturn=False)
+        return surf
+
+    def _present_dirty(self, commands):
+        rects = []
+        draws = set()
+        for cmd in commands:
+            area = cmd[2] if len(cmd) == 3 else None
+            w, h = cmd[0].get_size() if area is None else area.size
+            rect = pygame.Rect(cmd[1][0], cmd[1][1], w, h)
+            rects.append(rect)
+            draws.add((cmd[0], None if area is None else tuple(area), tuple(rect)))
+
+        damaged = [pygame.Rect(i[2]).inflate(2, 2) for i in draws ^ self._last_draws]
+        camera = (self.camerax, self.cameray)
+        self._last_draws = draws
+
+        if camera != self._last_camera or len(damaged) > self.DIRTY_LIMIT:
+            self._last_camera = camera
+            self._display.fill(0)
+            self._display.blits(commands, doreturn=False)
+            pygame.display.flip()
+            return
+
+        screen = self._display.get_rect()
+        damaged = [i.clip(screen) for i in damaged]
+        for rect in damaged:
+            self._display.set_clip(rect)
+            self._display.fill(0, rect)
+            self._display.blits([commands[i] for i in rect.collidelistall(rects)], doreturn=False)
+        self._display.set_clip(None)
+        pygame.display.update(damaged)
+
+    def switch_frame(self, fn):
+        start = time.perf_counter()
+        self._atlas = {}
+        self._last_camera = None
+        super().switch_frame(fn)
+        self._load_bank(self.frames[fn])
+        if self.ATLAS:
+            self._atlas = pack_atlases([img for key, img in self._assets.in_use() if key[0] == "image"], self.ATLAS_SIZE)
+        self.load_time = time.perf_counter() - start
+        if self.REPORT_TIMINGS:
+            print("Frame %d loaded in %.1f ms" % (fn, self.load_time * 1000))
 
     def image_load(self, path):
-        return pygame.image.load(self.fileloader.get_file(path))
+        return self._assets.get(("image", path), lambda: self._prepare(self._decode(path)), self._surface_size)
+
+    def _decode(self, path):
+        self._adopt_preloads()
+        surf = self._assets.take(("decoded", path))
+        if surf is None:
+            surf = pygame.image.load(*self._open(path))
+        return surf
+
+    def _open(self, path):
+        """Arguments for pygame's loaders: a filename, or a file object and name hint"""
+        f = self.fileloader.get_file(path)
+        if isinstance(f, str):
+            return (f,)
+        return (io.BytesIO(f), path)   # Buffer from an archive
+
+    def preload_assets(self, frame):
+        # Only decode here; converting to the display format stays on the
+        # main thread, in image_load.
+        for path in frame.attribute_values("Sprite name"):
+            with self._preload_lock:
+                if ("image", path) in self._assets.entries or ("decoded", path) in self._assets.entries or \
+                   path in self._preloaded:
+                    continue
+            surf = pygame.image.load(*self._open(path))
+            with self._preload_lock:
+                self._preloaded[path] = surf
+
+        if not self._audio:
+            return
+        for path in frame.sound_paths():
+            with self._preload_lock:
+                if ("sfx", path) in self._assets.entries or ("decoded sfx", path) in self._assets.entries or \
+                   path in self._preloaded_sfx:
+                    continue
+            sound = pygame.mixer.Sound(self._open(path)[0])
+            with self._preload_lock:
+                self._preloaded_sfx[path] = sound
+
+    def _adopt_preloads(self):
+        # Hand what preload_assets decoded to the asset cache as unused
+        # entries, so it counts against ASSET_BUDGET and is evicted if no
+        # object loads it. AssetCache isn't thread safe, so this runs on the
+        # main thread: every frame and before decoding anything.
+        if not self._preloaded and not self._preloaded_sfx:
+            return
+        with self._preload_lock:
+            images, self._preloaded = self._preloaded, {}
+            sounds, self._preloaded_sfx = self._preloaded_sfx, {}
+        for path, surf in images.items():
+            self._assets.put(("decoded", path), surf, self._surface_size(surf))
+        for path, sound in sounds.items():
+            self._assets.put(("decoded sfx", path), sound, self._sound_size(sound))
 
     def image_scale(self, img, x, y):
-        return pygame.transform.scale(img, (img.get_width() * x, img.get_width() * y))
+        def load():
+            return pygame.transform.scale(img, (img.get_width() * x, img.get_height() * y))
+
+        key = self._assets.key_of(img)
+        if key is None:
+            return load()
+        return self._assets.get(("scale", key, x, y), load, self._surface_size)
+
+    def image_release(self, img):
+        self._assets.release(img)
 
     def sfx_load(self, path):
-        return pygame.mixer.Sound(path)
+        return self._assets.get(("sfx", path), lambda: self._decode_sound(path), self._sound_size)
+
+    def _decode_sound(self, path):
+        self._adopt_preloads()
+        sound = self._assets.take(("decoded sfx", path))
+        if sound is None:
+            sound = pygame.mixer.Sound(self._open(path)[0])
+        return sound
+
+    def sfx_release(self, sfx):
+        self._assets.release(sfx)
+
+    def _load_bank(self, frame):
+        # Decode every sound the frame's grid plays now, so playing one
+        # never has to. Sounds the old frame also used stay loaded.
+        if not self._audio:
+            return
+        bank = {}
+        for path in frame.sound_paths():
+            sound = self._bank.pop(path, None)
+            bank[path] = sound if sound is not None else self.sfx_load(path)
+        for sound in self._bank.values():
+            self.sfx_release(sound)
+        self._bank = bank
+
+    def play_sound(self, path, priority=0):
+        if not self._audio:
+            return
+        sound = self._bank.get(path)
+        if sound is None:   # Not in the grid, e.g. played from an object's code
+            sound = self._bank[path] = self.sfx_load(path)
+
+        # A free channel, else steal the one playing the least important
+        # sound, oldest first, unless everything playing matters more
+        voice = None
+        for i, channel in enumerate(self._channels):
+            if not channel.get_busy():
+                voice = i
+                break
+            if self._voices[i][0] <= priority and (voice is None or self._voices[i] < self._voices[voice]):
+                voice = i
+        if voice is None:
+            return
+        self._voice_count += 1
+        self._voices[voice] = (priority, self._voice_count)
+        self._channels[voice].play(sound)
+
+    @staticmethod
+    def _prepare(surf):
+        """Convert to the display pixel format so blits don't have to"""
+        if surf.get_flags() & pygame.SRCALPHA:
+            return surf.convert_alpha()
+        return surf.convert()
+
+    @staticmethod
+    def _surface_size(surf):
+        return surf.get_pitch() * surf.get_height()
+
+    @staticmethod
+    def _sound_size(sound):
+        freq, size, channels = pygame.mixer.get_init()
+        return int(sound.get_length() * freq) * channels * abs(size) // 8
 
     def mus_play(self, path):
-        pygame.mixer.music.load(path)
+        # Opening and starting the stream happens on a worker thread so it
+        # never holds up a frame; only the latest request gets to play.
+        if not self._audio:
+            return
+        if self._music_pool is None:
+            self._music_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="music")
+        self._music_request += 1
+        self._music_pool.submit(self._stream_music, path, self._music_request)
+
+    def _stream_music(self, path, request):
+        if request != self._music_request:
+            return
+        source = self._open(path)[0]
+        pygame.mixer.music.load(source)
+        self._music_source = source
         pygame.mixer.music.play()
 
     def get_axis(self, axis):
         if type(axis) != int:
             raise TypeError
-        
-        if mmfbase.AxisNames.player(axis) != 1:
-            return 0
-        
-        axis_norm = mmfbase.AxisNames.as_p1(axis)
-        keys = pygame.key.get_pressed()
-
-        # print(mmfbase.AxisNames.to_string(axis), mmfbase.AxisNames.to_string(axis_norm))
-
-        if axis_norm == mmfbase.AxisNames.P1_VERTICAL:
-            positive = int(keys[pygame.K_w] or keys[pygame.K_UP])
-            negative = int(keys[pygame.K_s] or keys[pygame.K_DOWN])
-            return positive - negative
-
-        if axis_norm == mmfbase.AxisNames.P1_HORIZONTAL:
-            positive = int(keys[pygame.K_d] or keys[pygame.K_RIGHT])
-            negative = int(keys[pygame.K_a] or keys[pygame.K_LEFT])
-            return positive - negative
-
-        return 0
+        return self.input.axes.get(axis, 0)
 
     def get_time(self):
-        return self._clock.get_time() / 1000
+        return self._dt
+
+    def now(self):
+        # Game time rather than wall time, so recordings replay timers exactly
+        return self._time
 
 
 @mmfbase.register("Input")
@@ -96,110 +552,77 @@ class Input(mmfbase.Object):
     EVENTS = mmfbase.Object.EVENTS + [("Key pressed", str), ("Key released", str)]
     ACTIONS = mmfbase.Object.ACTIONS
 
+    __slots__ = ["snapshot", "pressed", "released"]
+
+    SPECIAL_KEY_MAP = {
+        "ESC": pygame.K_ESCAPE,
+        "RETURN": pygame.K_RETURN
+    }
+
     def init(self):
-        self.last_pressed = pygame.key.get_pressed()
-        self.pressed      = pygame.key.get_pressed()
-        self.SPECIAL_KEY_MAP = {
-            "ESC": pygame.K_ESCAPE,
-            "RETURN": pygame.K_RETURN
-        }
+        self.snapshot = self.game.input
+        self.pressed = self.released = frozenset()
 
     def tick(self):
-        self.last_pressed = self.pressed
-        self.pressed = pygame.key.get_pressed()
+        # Edges are taken once per snapshot, so extra logic steps in the
+        # same frame see no presses. The grid tick after this one is what
+        # compares them, so that is when rows for the key events need to run.
+        snapshot = self.game.input
+        if snapshot is self.snapshot:
+            self.pressed = self.released = frozenset()
+            return
+        self.snapshot = snapshot
+        snapshot.taken = True
+        self.pressed = snapshot.pressed
+        self.released = snapshot.released
+
+        for key in self.pressed:
+            self.game.triggers.fire(("Key pressed", key))
+        for key in self.released:
+            self.game.triggers.fire(("Key released", key))
     
+    def save_state(self, index):
+        return (tuple(sorted(self.pressed)), tuple(sorted(self.released)))
+
+    def load_state(self, state, objs):
+        # Edges of the current snapshot were either taken already or are in state
+        self.snapshot = self.game.input
+        self.pressed = frozenset(state[0])
+        self.released = frozenset(state[1])
+
     def check_event(self, name, arg):
         if name == "Key pressed":
-            key_id = self.SPECIAL_KEY_MAP.get(arg, arg)
-            if (not self.last_pressed[key_id]) and self.pressed[key_id]:
-                return [self]
-            return None
+            return self.key_pressed(self.SPECIAL_KEY_MAP.get(arg, arg))
 
         elif name == "Key released":
-            key_id = self.SPECIAL_KEY_MAP.get(arg, arg)
-            if self.last_pressed[key_id] and (not self.pressed[key_id]):
-                return [self]
-            return None
+            return self.key_released(self.SPECIAL_KEY_MAP.get(arg, arg))
 
     def handle_action(self, name, value):
         ...
 
+    @classmethod
+    def event_trigger(cls, name, arg):
+        if name == "Key pressed":
+            return ("Key pressed", cls.SPECIAL_KEY_MAP.get(arg, arg))
+        elif name == "Key released":
+            return ("Key released", cls.SPECIAL_KEY_MAP.get(arg, arg))
+        return super().event_trigger(name, arg)
 
-@mmfbase.register("Game")
-class GameObject(mmfbase.Object):
-
-    ATTRIBUTE_NAMES = mmfbase.Object.ATTRUBUTE_NAMES
-    EVENTS = mmfbase.Object.EVENTS + [("Timer expired", str), ("Frame start",)]
-    ACTIONS = mmfbase.Object.ACTIONS + [
-        ("Set timer #0", float),
-        ("Set timer #1", float),
-        ("Set timer #2", float),
-        ("Set timer #3", float),
-        ("Set timer #4", float),
-        ("Set timer #5", float),
-        ("Set timer #6", float),
-        ("Set timer #7", float),
-        ("Set timer #8", float),
-        ("Set timer #9", float),
-        ("Close game window",),
-        ("Create object", dict),
-        ("Camera: Move", list),
-        ("Camera: Follow object", str)
-    ]
-    
-    def init(self):
-        self.timers = {}
-        self.frame_start_sent = False
-        self.cam_following = None
-
-    def tick(self):
-        if self.cam_following is not None:
-            self.game.camerax = self.cam_following.pos[0] - 800 // 2
-            self.game.cameray = -self.cam_following.pos[1] - 600 // 2
-
-    def check_event(self, name, arg):
-        if name == "Timer expired":
-            # print(self.timers, repr(arg))
-            if arg not in self.timers:
-                return
-            if time.perf_counter() - self.timers[arg][0] > self.timers[arg][1]:
-                del self.timers[arg]
-                return [self]
-
-        elif name == "Frame start":
-            if not self.frame_start_sent:
-                self.frame_start_sent = True
-                return [self]
-
-    def on_destroy(self):
-        raise mmfbase.Exit
-
-    def handle_action(self, name, value):
-        if name.startswith("Set timer #"):
-            timern = int(name[-1])
-            self.timers[timern] = [time.perf_counter(), value]
-
-        elif name == "Close game window":
-            raise mmfbase.Exit
-        
-        elif name == "Create object":
-            print(value)
-            try:
-                objinfo = mmfbase.ObjInfo.from_dict(value)
-            except KeyError as e:
-                raise mmfbase.ObjectError("Create object failed: " + str(e))
-
-            objinfo.create_object(self.game, self.objs)
-            objinfo.fill_attributes()
-
-        elif name == "Camera: Move":
-            self.game.camerax = value[0]
-            self.game.cameray = -value[1]
-
-        elif name == "Camera: Follow object":
-            if value is None:
-                self.cam_following = None
-            else:
-                self.cam_following = self.game.frames[self.game.current_frame].grid.find_objects(self.objs, value)[0]
-                self.game.camerax = self.cam_following.pos[0] - 800 // 2
-                self.game.cameray = -self.cam_following.pos[1] - 600 // 2
+    @classmethod
+    def compile_event(cls, name, arg):
+        key_id = cls.SPECIAL_KEY_MAP.get(arg, arg)
+        if name == "Key pressed":
+            return lambda obj: obj.key_pressed(key_id)
+        elif name == "Key released":
+            return lambda obj: obj.key_released(key_id)
+        return super().compile_event(name, arg)
+
+    def key_pressed(self, key_id):
+        if key_id in self.pressed:
+            return [self]
+        return None
+
+    def key_released(self, key_id):
+        if key_id in self.released:
+            return [self]
+        return None
@@ -0,0 +1,171 @@
+"""Optional struct-of-arrays storage for VisibleObjects.
+
+Needs NumPy. Enabled with mmfbase.Game.enable_batch(); objects keep their
+usual pos/vx/vy attributes, which read and write the arrays below. Movement
+is integrated for every slot at once in step(). Objects stay in
+game.spatial as in plain mode (step() moves the ones whose cells changed),
+and collide() runs the overlap test on the candidates it finds as one
+array operation when there are enough of them."""
+
+import numpy as np
+from mmfbase import AxisNames
+
+MOVE_STATIC = -1   # Background and anything else that never moves by itself
+MOVE_NONE = 0
+MOVE_TOPDOWN = 1
+
+MOVEMENT_TYPES = {"None": MOVE_NONE, "Top-down": MOVE_TOPDOWN}
+
+STALE = np.iinfo(np.int64).min   # Cell range that never matches a real one
+
+class Batch():
+
+    COLLIDE_MIN = 24   # Fewer collision candidates are cheaper to test one by one than through NumPy
+
+    def __init__(self, game, capacity=256):
+        self.game = game
+        self.count = 0        # Slots [0, count) have been handed out at least once
+        self.free = []
+        self.objs = [None] * capacity
+        self._positions = None  # Cached positions(), until pos changes again
+
+        self.pos = np.zeros((capacity, 2))
+        self.size = np.zeros((capacity, 2))
+        self.vel = np.zeros((capacity, 2))
+        self.damping = np.ones(capacity)
+        self.speed = np.zeros(capacity)
+        self.movement = np.full(capacity, MOVE_STATIC, dtype=np.int8)
+        self.cells = np.full((capacity, 4), STALE, dtype=np.int64)  # Spatial hash range as of the last step
+
+    def _grow(self):
+        capacity = len(self.objs) * 2
+        for i in ["pos", "size", "vel", "damping", "speed", "movement", "cells"]:
+            old = getattr(self, i)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, i, new)
+        self.objs.extend([None] * (capacity - len(self.objs)))
+
+    def add(self, obj, pos, size):
+        if self.free:
+            slot = self.free.pop()
+        else:
+            if self.count == len(self.objs):
+                self._grow()
+            slot = self.count
+            self.count += 1
+
+        self.objs[slot] = obj
+        self.pos[slot] = pos
+        self.size[slot] = size
+        self.vel[slot] = 0
+        self.damping[slot] = 1
+        self.speed[slot] = 0
+        self.movement[slot] = MOVE_STATIC
+        self.cells[slot] = STALE
+        self._positions = None
+        return slot
+
+    def remove(self, obj, slot):
+        self.objs[slot] = None
+        self.movement[slot] = MOVE_STATIC
+        self.free.append(slot)
+
+    def move(self, slot, pos):
+        """Set a position from outside step(). The caller updates game.spatial"""
+        self.pos[slot] = pos
+        self.cells[slot] = STALE
+        self._positions = None
+
+    def pack(self, slots, velocity=False):
+        """x0, y0, x1, y1, ... of slots as native doubles, then every vx
+        and every vy if velocity, as VisibleObject/Active.save_states"""
+        pos = self.pos[slots].ravel()
+        if velocity:
+            vel = self.vel[slots]
+            return np.concatenate([pos, vel[:, 0], vel[:, 1]]).tobytes()
+        return pos.tobytes()
+
+    def unpack(self, slots, data, velocity=False):
+        """Counterpart of pack, also moves the slots in game.spatial"""
+        slots = np.asarray(slots, dtype=np.intp)
+        values = np.frombuffer(data, dtype=np.float64)
+        n = len(slots)
+        self.pos[slots] = values[:2 * n].reshape(n, 2)
+        if velocity:
+            self.vel[slots, 0] = values[2 * n:3 * n]
+            self.vel[slots, 1] = values[3 * n:]
+        self._positions = None
+        self._update_spatial(slots)
+
+    def positions(self):
+        """Flat [x0, y0, x1, y1, ...] list of every slot's position, for
+        reading many positions at once. Flat so that refreshing it doesn't
+        allocate a list per object for the garbage collector to track"""
+        if self._positions is None:
+            self._positions = self.pos[:self.count].ravel().tolist()
+        return self._positions
+
+    def collide(self, slot, slots):
+        """Index into slots of the first one whose box overlaps slot's, by
+        the corner test of VisibleObject.check_overlap; -1 if none"""
+        x0, y0 = self.pos[slot]
+        x1, y1 = self.pos[slot] + self.size[slot]
+        start = self.pos[slots]
+        end = start + self.size[slots]
+        # A corner of the other box is inside this one when its x and its y
+        # both are; any corner is when either x and either y are
+        in_x = ((start[:, 0] >= x0) & (start[:, 0] <= x1)) | ((end[:, 0] >= x0) & (end[:, 0] <= x1))
+        in_y = ((start[:, 1] >= y0) & (start[:, 1] <= y1)) | ((end[:, 1] >= y0) & (end[:, 1] <= y1))
+        hits = np.flatnonzero(in_x & in_y)
+        return int(hits[0]) if len(hits) else -1
+
+    def set_movement(self, slot, mvtype, damping, speed):
+        """Returns False if mvtype is not a known movement type"""
+        if mvtype not in MOVEMENT_TYPES:
+            return False
+        self.movement[slot] = MOVEMENT_TYPES[mvtype]
+        self.damping[slot] = damping
+        self.speed[slot] = speed
+        return True
+
+    def step(self):
+        """Same integration as Active.move, for every moving slot at once"""
+        n = self.count
+        movement = self.movement[:n]
+        moving = movement != MOVE_STATIC
+        if not moving.any():
+            return
+
+        dt = self.game.step_time()
+        vel = self.vel[:n]
+        topdown = movement == MOVE_TOPDOWN
+        if topdown.any():
+            hor = self.game.get_axis(AxisNames.P1_HORIZONTAL)
+            ver = self.game.get_axis(AxisNames.P1_VERTICAL)
+            if hor:
+                vel[topdown, 0] = hor * self.speed[:n][topdown]
+            if ver:
+                vel[topdown, 1] = ver * self.speed[:n][topdown]
+
+        damping = self.damping[:n][moving] ** dt
+        vel[moving] *= damping[:, None]
+        self.pos[:n][moving] += vel[moving] * dt
+        self._positions = None
+        self._update_spatial(np.flatnonzero(moving))
+
+    def _update_spatial(self, slots):
+        # Same ranges as SpatialHash._range, only objects that changed cells
+        # go through SpatialHash.move
+        spatial = self.game.spatial
+        pos = self.pos[slots]
+        box = np.hstack([pos, pos + self.size[slots]])
+        cells = np.floor_divide(box, spatial.cell_size).astype(np.int64)
+        changed = np.flatnonzero((cells != self.cells[slots]).any(axis=1))
+        if len(changed) == 0:
+            return
+        moved = slots[changed]
+        self.cells[moved] = cells[changed]
+        objs = self.objs
+        for slot, (x0, y0, x1, y1) in zip(moved.tolist(), box[changed].tolist()):
+            spatial.move(objs[slot], x0, y0, x1, y1)
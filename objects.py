@@ -1 +1,18 @@
-from baseobjects import *
+# Object type manifest: type name -> module that registers it. A module is
+# only imported the first time a project creates one of its types (see
+# mmfbase.ObjInfo.object_type), so unused types cost nothing at startup.
+# "Input" comes with the rendering engine.
+import mmfbase
+
+TYPE_MODULES = {
+    "Background": "baseobjects",
+    "Active": "baseobjects",
+    "Game": "baseobjects",
+}
+
+mmfbase.ObjInfo.register_type_modules(TYPE_MODULES)
+
+def __getattr__(name):
+    # Old "objects.Active" style access still works, at the cost of loading them
+    import baseobjects
+    return getattr(baseobjects, name)
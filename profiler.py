@@ -0,0 +1,106 @@
+"""Optional instrumentation for mmfbase.Game.
+
+Enabled with Game.enable_profiling(); while it is off the engine never
+calls into this module."""
+
+import json
+import time
+import collections
+
+class Profiler():
+
+    def __init__(self, path=None, history=120):
+        self.path = path              # Where dump() writes when the game exits
+        self.rows = {}                # row label -> [runs, evaluations, matches, seconds]
+        self.actions = {}             # action label -> [calls, seconds]
+        self.objects = {}             # object type -> [ticks, seconds]
+        self.stages = {}              # frame stage -> seconds
+        self.frame_count = 0
+        self.frames = collections.deque(maxlen=history)   # Per-frame stage times
+        self._frame = {}
+
+    # Wrappers used by EventGrid.compile
+    def wrap_row(self, label, row):
+        stats = self.rows.setdefault(label, [0, 0, 0, 0.0])
+        clock = time.perf_counter
+
+        def timed_row():
+            start = clock()
+            try:
+                row()
+            finally:
+                stats[0] += 1
+                stats[3] += clock() - start
+        return timed_row
+
+    def wrap_event(self, label, check):
+        stats = self.rows.setdefault(label, [0, 0, 0, 0.0])
+
+        def counted_check(obj):
+            related = check(obj)
+            stats[1] += 1
+            if related:
+                stats[2] += 1
+            return related
+        return counted_check
+
+    def wrap_action(self, label, handler):
+        stats = self.actions.setdefault(label, [0, 0.0])
+        clock = time.perf_counter
+
+        def timed_handler(obj):
+            start = clock()
+            try:
+                handler(obj)
+            finally:
+                stats[0] += 1
+                stats[1] += clock() - start
+        return timed_handler
+
+    # Called by Game
+    def object_tick(self, cls, seconds):
+        stats = self.objects.get(cls.__name__)
+        if stats is None:
+            stats = self.objects[cls.__name__] = [0, 0.0]
+        stats[0] += 1
+        stats[1] += seconds
+
+    def stage(self, name, seconds):
+        """Add time spent in a stage; stages may run several times per frame"""
+        self._frame[name] = self._frame.get(name, 0.0) + seconds
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def end_frame(self):
+        self._frame["total"] = sum(self._frame.values())
+        self.frames.append(self._frame)
+        self._frame = {}
+        self.frame_count += 1
+
+    # Reports
+    def report(self):
+        """Totals so far plus stage averages over the last `history` frames"""
+        recent = {}
+        for frame in self.frames:
+            for name, seconds in frame.items():
+                recent[name] = recent.get(name, 0.0) + seconds
+        if self.frames:
+            recent = {name: seconds / len(self.frames) for name, seconds in recent.items()}
+
+        return {
+            "frames": self.frame_count,
+            "stages": dict(self.stages),
+            "recent": recent,
+            "last_frame": self.frames[-1] if self.frames else {},
+            "rows": {label: {"runs": s[0], "evaluations": s[1], "matches": s[2],
+                             "match_rate": s[2] / s[1] if s[1] else 0.0, "time": s[3]}
+                     for label, s in self.rows.items()},
+            "actions": {label: {"calls": s[0], "time": s[1]} for label, s in self.actions.items()},
+            "objects": {name: {"ticks": s[0], "time": s[1]} for name, s in self.objects.items()},
+        }
+
+    def dump(self, path=None):
+        path = path or self.path
+        if path is None:
+            return
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=1)
@@ -0,0 +1,248 @@
+"""Compiled binary cache of a project.json.
+
+The cache holds the same data as the JSON, but frames are stored as
+compact object/event tables referring to a shared table of interned
+atoms (strings and JSON-encoded values). It is memory-mapped, and a frame
+is only decoded when it is asked for.
+
+Build one explicitly with
+
+    python projectcache.py "test project"
+
+or let jsondir_reader.Reader write it on first load."""
+
+import os
+import sys
+import json
+import mmap
+import zlib
+import struct
+import hashlib
+
+MAGIC = b"MMFC"
+VERSION = 3
+
+HEADER = struct.Struct("<4sIQQ20sIIII") # magic, version, mtime_ns, size, sha1, atoms, frames, extra keys atom,
+                                        # CRC-32 of everything after the header
+SPAN = struct.Struct("<II")             # offset, length
+COUNT = struct.Struct("<I")
+OBJECT = struct.Struct("<IIIIi")        # type, name, pos, attrib, duplicate_of (-1: None)
+EVENT = struct.Struct("<IIII")          # name, objname, arg, action count
+ACTION = struct.Struct("<III")          # name, objname, value
+
+class CacheError(Exception):
+    pass
+
+class _Atoms():
+
+    def __init__(self):
+        self.atoms = []
+        self.index = {}
+
+    def add(self, data):
+        i = self.index.get(data)
+        if i is None:
+            i = self.index[data] = len(self.atoms)
+            self.atoms.append(data)
+        return i
+
+    def string(self, s):
+        return self.add(b"s" + s.encode("utf-8"))
+
+    def value(self, v):
+        return self.add(b"j" + json.dumps(v, separators=(",", ":"), sort_keys=True).encode("utf-8"))
+
+def compile_project(d, mtime_ns=0, size=0, sha1=b"\0" * 20):
+    """Encode a project dict (as read from project.json) into cache bytes"""
+    atoms = _Atoms()
+    extra = atoms.value({key: value for key, value in d.items() if key != "frames"})
+    frames = []
+    for frame in d["frames"]:
+        out = [COUNT.pack(len(frame["objs"]))]
+        for obj in frame["objs"]:
+            dup = obj["duplicate_of"]
+            out.append(OBJECT.pack(atoms.string(obj["type"]), atoms.string(obj["name"]), atoms.value(obj["pos"]),
+                                   atoms.value(obj["attrib"]), -1 if dup is None else dup))
+        out.append(COUNT.pack(len(frame["grid"])))
+        for event, actions in frame["grid"]:
+            out.append(EVENT.pack(atoms.string(event["name"]), atoms.string(event["objname"]),
+                                  atoms.value(event["arg"]), len(actions)))
+            for action in actions:
+                out.append(ACTION.pack(atoms.string(action["name"]), atoms.string(action["objname"]),
+                                       atoms.value(action["value"])))
+        frames.append(b"".join(out))
+
+    tables_size = HEADER.size + SPAN.size * (len(atoms.atoms) + len(frames))
+    spans = []
+    offset = tables_size
+    for blob in atoms.atoms + frames:
+        spans.append(SPAN.pack(offset, len(blob)))
+        offset += len(blob)
+
+    body = b"".join(spans + atoms.atoms + frames)
+    return HEADER.pack(MAGIC, VERSION, mtime_ns, size, sha1, len(atoms.atoms), len(frames), extra,
+                       zlib.crc32(body)) + body
+
+def build(json_path, cache_path):
+    """Compile json_path into cache_path, returns the parsed project dict"""
+    with open(json_path, "rb") as f:
+        data = f.read()
+    st = os.stat(json_path)
+    d = json.loads(data)
+    blob = compile_project(d, st.st_mtime_ns, st.st_size, hashlib.sha1(data).digest())
+
+    # Per process, so batchrun workers building the same cache don't write
+    # into each other's file; the last os.replace wins
+    tmp = "%s.%d.tmp" % (cache_path, os.getpid())
+    try:
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, cache_path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return d
+
+class CachedProject():
+    """Read-only view of a cache file that looks like the project dict.
+
+    project["frames"] is a sequence whose items are frame dicts, decoded on
+    access. Other top-level keys are decoded up front."""
+
+    def __init__(self, cache_path):
+        with open(cache_path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buf = memoryview(self._map)
+        try:
+            self._read_tables()
+        except CacheError:
+            self.close()   # Unmap now, the reader replaces the file next
+            raise
+        self.frames = _Frames(self)
+        self.extra = self._atom(self._extra)   # Top-level keys other than "frames"
+
+    def _read_tables(self):
+        if len(self._buf) < HEADER.size:
+            raise CacheError("Truncated cache")
+        magic, version, self.mtime_ns, self.size, self.sha1, natoms, nframes, extra, crc = HEADER.unpack_from(self._buf)
+        if magic != MAGIC or version != VERSION:
+            raise CacheError("Not a project cache, or wrong version")
+        # The sha1 is project.json's; this catches a damaged cache file
+        if zlib.crc32(self._buf[HEADER.size:]) != crc:
+            raise CacheError("Corrupt cache")
+
+        # Check every span against the file, a truncated or corrupt cache
+        # should be rebuilt rather than fail somewhere in decode_frame
+        spans = HEADER.size
+        tables_end = spans + SPAN.size * (natoms + nframes)
+        if tables_end > len(self._buf) or extra >= natoms:
+            raise CacheError("Truncated cache")
+        self._atom_spans = [SPAN.unpack_from(self._buf, spans + i * SPAN.size) for i in range(natoms)]
+        spans += natoms * SPAN.size
+        self._frame_spans = [SPAN.unpack_from(self._buf, spans + i * SPAN.size) for i in range(nframes)]
+        for offset, length in self._atom_spans + self._frame_spans:
+            if offset < tables_end or offset + length > len(self._buf):
+                raise CacheError("Truncated cache")
+        self._atoms = [None] * natoms
+        self._extra = extra
+
+    def __getitem__(self, key):
+        if key == "frames":
+            return self.frames
+        return self.extra[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def is_valid_for(self, json_path):
+        """Whether the cache was built from json_path as it is now"""
+        st = os.stat(json_path)
+        if st.st_mtime_ns == self.mtime_ns and st.st_size == self.size:
+            return True
+        if st.st_size != self.size:
+            return False
+        with open(json_path, "rb") as f:
+            return hashlib.sha1(f.read()).digest() == self.sha1
+
+    def close(self):
+        self._buf.release()
+        self._map.close()
+
+    def _atom(self, i):
+        v = self._atoms[i]
+        if v is None:
+            offset, length = self._atom_spans[i]
+            data = bytes(self._buf[offset:offset + length])
+            if data[:1] == b"s":
+                v = sys.intern(data[1:].decode("utf-8"))
+            else:
+                v = (data[1:],)   # JSON, decoded fresh on every use since values are mutable
+            self._atoms[i] = v
+        if type(v) is tuple:
+            return json.loads(v[0])
+        return v
+
+    def decode_frame(self, n):
+        try:
+            return self._decode_frame(n)
+        except (struct.error, IndexError, ValueError) as e:
+            raise CacheError("Corrupt frame %d in cache: %s" % (n, e))
+
+    def _decode_frame(self, n):
+        start, length = self._frame_spans[n]
+        buf = self._buf[start:start + length]   # Reads past the frame's end raise struct.error
+        atom = self._atom
+        offset = 0
+
+        objs = []
+        count, = COUNT.unpack_from(buf, offset)
+        offset += COUNT.size
+        for _ in range(count):
+            type, name, pos, attrib, dup = OBJECT.unpack_from(buf, offset)
+            offset += OBJECT.size
+            objs.append({"type": atom(type), "name": atom(name), "pos": atom(pos), "attrib": atom(attrib),
+                         "duplicate_of": None if dup < 0 else dup})
+
+        grid = []
+        count, = COUNT.unpack_from(buf, offset)
+        offset += COUNT.size
+        for _ in range(count):
+            name, objname, arg, nactions = EVENT.unpack_from(buf, offset)
+            offset += EVENT.size
+            actions = []
+            for _ in range(nactions):
+                aname, aobjname, value = ACTION.unpack_from(buf, offset)
+                offset += ACTION.size
+                actions.append({"name": atom(aname), "objname": atom(aobjname), "value": atom(value)})
+            grid.append([{"name": atom(name), "objname": atom(objname), "arg": atom(arg)}, actions])
+
+        return {"objs": objs, "grid": grid}
+
+class _Frames():
+
+    __slots__ = ["project"]
+
+    def __init__(self, project):
+        self.project = project
+
+    def __len__(self):
+        return len(self.project._frame_spans)
+
+    def __getitem__(self, n):
+        if not 0 <= n < len(self):
+            raise IndexError(n)
+        return self.project.decode_frame(n)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python projectcache.py <project directory>")
+        sys.exit(1)
+    build(os.path.join(sys.argv[1], "project.json"), os.path.join(sys.argv[1], "project.mmfc"))
@@ -0,0 +1,158 @@
+"""Input recording and replay for mmfpygame.
+
+A recording holds the timestep settings (tick_rate, max_steps, batch
+mode) it was made with and, for every frame, the frame time, the input snapshot
+(non-zero axes and keys pressed/released) and, every hash_interval
+frames, a hash of the game state at the start of that frame. Replaying feeds them back instead of reading the
+keyboard and the clock, without waiting for the frame rate cap, and checks
+the hashes, so a recorded session is a regression test and a benchmark at
+once:
+
+    python replay.py "test project" session.mmfr
+
+Record one with Game.enable_recording (RECORD in main.py)."""
+
+import sys
+import json
+import time
+import array
+import struct
+import hashlib
+import argparse
+import importlib
+
+MAGIC = b"MMFR"
+VERSION = 3   # 1 hashed whole snapshots, 2 had no timestep settings
+
+HEADER = struct.Struct("<4sIIdIB") # magic, version, hash interval, tick rate (0: None), max steps, batch mode
+FRAME = struct.Struct("<dQBBB")    # frame time, state hash (0 between intervals), axes, keys pressed, keys released
+AXIS = struct.Struct("<Bb")        # AxisNames slot, value
+KEY = struct.Struct("<i")
+
+class DesyncError(RuntimeError):
+    pass
+
+_moving = {}   # Class -> whether it has vx/vy
+
+def state_hash(game):
+    """64-bit hash of the state a desync shows up in: every object's uid and
+    position, velocities, camera, pending triggers and timers.
+
+    Runs every frame while recording and replaying, so it reads those
+    directly in object order instead of going through Game.snapshot.
+    Attribute values aren't covered; changing them changes behaviour, which
+    shows up in the positions soon enough."""
+    objs = list(game.objs)
+    now = game.now()
+    moving = []
+    for obj in objs:
+        cls = obj.__class__
+        has_vel = _moving.get(cls)
+        if has_vel is None:
+            has_vel = _moving[cls] = hasattr(cls, "vx")
+        if has_vel:
+            moving.append(obj)
+    triggers = game.triggers
+    h = hashlib.blake2b(digest_size=8)
+    h.update(array.array("q", [obj.uid for obj in objs]).tobytes())
+    h.update(array.array("d", [c for obj in objs for c in obj.pos]).tobytes())
+    h.update(array.array("d", [v for obj in moving for v in (obj.vx, obj.vy)]).tobytes())
+    h.update(repr((game.current_frame, game.camerax, game.cameray, game._accumulator,
+                   sorted(triggers.pending, key=repr),
+                   sorted([(deadline - now, key) for deadline, _, key in triggers.timers], key=repr))).encode())
+    return int.from_bytes(h.digest(), "little")
+
+class Recorder():
+
+    def __init__(self, path, hash_interval=1, tick_rate=None, max_steps=5, batch=False):
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, hash_interval, tick_rate or 0.0, max_steps, batch))
+        self.hash_interval = hash_interval
+        self.frame = 0     # Frames written so far
+
+    def hash_due(self):
+        """Whether the frame about to be written gets a state hash"""
+        return self.frame % self.hash_interval == 0
+
+    def write(self, dt, state, snapshot):
+        axes = [(axis, value) for axis, value in snapshot.axes.items() if value]
+        pressed = sorted(snapshot.pressed)
+        released = sorted(snapshot.released)
+        parts = [FRAME.pack(dt, state, len(axes), len(pressed), len(released))]
+        parts += [AXIS.pack(axis, value) for axis, value in axes]
+        parts += [KEY.pack(key) for key in pressed + released]
+        self.file.write(b"".join(parts))
+        self.frame += 1
+
+    def close(self):
+        self.file.close()
+
+class Player():
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = f.read()
+        if len(self.data) < HEADER.size:
+            raise ValueError("%s is not a recording" % path)
+        magic, version, self.hash_interval, tick_rate, self.max_steps, batch = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a recording, or from another version" % path)
+        self.tick_rate = tick_rate or None
+        self.batch = bool(batch)
+        self.offset = HEADER.size
+        self.frame = 0     # Frames read so far
+
+    def next_frame(self):
+        """(dt, state hash, {axis: value}, pressed, released), None at the end.
+        The hash is None on frames between hash intervals"""
+        data = self.data
+        offset = self.offset
+        if offset >= len(data):
+            return None
+        dt, state, naxes, npressed, nreleased = FRAME.unpack_from(data, offset)
+        offset += FRAME.size
+        axes = {}
+        for _ in range(naxes):
+            axis, value = AXIS.unpack_from(data, offset)
+            offset += AXIS.size
+            axes[axis] = value
+        keys = [KEY.unpack_from(data, offset + i * KEY.size)[0] for i in range(npressed + nreleased)]
+        offset += KEY.size * (npressed + nreleased)
+        self.offset = offset
+        if self.frame % self.hash_interval:
+            state = None
+        self.frame += 1
+        return dt, state, axes, frozenset(keys[:npressed]), frozenset(keys[npressed:])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded session as fast as possible and check it")
+    parser.add_argument("project")
+    parser.add_argument("recording")
+    parser.add_argument("--reader", default="jsondir_reader", help="file format module (default: jsondir_reader)")
+    parser.add_argument("--no-verify", action="store_true", help="skip the state hashes, for benchmarking")
+    parser.add_argument("--no-render", action="store_true", help="skip drawing")
+    args = parser.parse_args(argv)
+
+    import mmfpygame
+    import objects
+    import replay   # The module mmfpygame raises DesyncError from, this one may be __main__
+    reader = importlib.import_module(args.reader).Reader(args.project)
+    game = mmfpygame.Game.from_dict(reader, reader.get_project_file())
+    player = game.enable_replay(args.recording, verify=not args.no_verify)
+    game.render = not args.no_render
+
+    start = time.perf_counter()
+    result = {"recording": args.recording, "ok": True}
+    try:
+        game.run()
+    except replay.DesyncError as e:
+        result["ok"] = False
+        result["error"] = str(e)
+    total = time.perf_counter() - start
+    frames = player.frame
+    result.update({"frames": frames, "time": total, "fps": frames / total if total else None})
+    print(json.dumps(result))
+    return 0 if result["ok"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""Binary encoding for Game.snapshot.
+
+A small tagged format of our own, so save states stay readable across
+Python versions (unlike marshal). It covers None, bools, ints, floats,
+strings, bytes, lists, tuples, dicts and array.array of "q" (ints) or "d"
+(floats); arrays are stored as raw little-endian items, which is how the
+bulk of a snapshot (uids, positions...) is kept.
+
+    blob = savestate.dumps(value)
+    value = savestate.loads(blob)"""
+
+import sys
+import array
+import struct
+
+MAGIC = b"MMFS"
+VERSION = 2   # 1 was a marshal dump
+
+HEADER = struct.Struct("<4sI")   # magic, version
+INT = struct.Struct("<q")
+FLOAT = struct.Struct("<d")
+COUNT = struct.Struct("<I")
+
+ARRAY_TYPES = {"q": 8, "d": 8}   # Typecode -> item size in the file
+
+class StateError(ValueError):
+    pass
+
+def dumps(value):
+    out = [HEADER.pack(MAGIC, VERSION)]
+    _dump(value, out)
+    return b"".join(out)
+
+def loads(data):
+    data = memoryview(data)
+    if len(data) < HEADER.size:
+        raise StateError("Not a save state")
+    magic, version = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise StateError("Not a save state")
+    if version != VERSION:
+        raise StateError("Save state version %d, expected %d" % (version, VERSION))
+    try:
+        value, offset = _load(data, HEADER.size)
+    except (struct.error, IndexError, KeyError, UnicodeDecodeError) as e:
+        raise StateError("Corrupt save state: %s" % e)
+    if offset != len(data):
+        raise StateError("Corrupt save state: trailing data")
+    return value
+
+def _dump(value, out):
+    kind = type(value)
+    if value is None:
+        out.append(b"N")
+    elif kind is bool:
+        out.append(b"T" if value else b"F")
+    elif kind is int:
+        if -2 ** 63 <= value < 2 ** 63:
+            out.append(b"i")
+            out.append(INT.pack(value))
+        else:
+            _dump_bytes(b"I", str(value).encode(), out)
+    elif kind is float:
+        out.append(b"d")
+        out.append(FLOAT.pack(value))
+    elif kind is str:
+        _dump_bytes(b"s", value.encode(), out)
+    elif kind is bytes:
+        _dump_bytes(b"b", value, out)
+    elif kind is list or kind is tuple:
+        out.append(b"l" if kind is list else b"t")
+        out.append(COUNT.pack(len(value)))
+        for item in value:
+            _dump(item, out)
+    elif kind is dict:
+        out.append(b"m")
+        out.append(COUNT.pack(len(value)))
+        for key, item in value.items():
+            _dump(key, out)
+            _dump(item, out)
+    elif kind is array.array and value.typecode in ARRAY_TYPES:
+        if sys.byteorder == "big":
+            value = array.array(value.typecode, value)
+            value.byteswap()
+        out.append(b"a" + value.typecode.encode())
+        out.append(COUNT.pack(len(value)))
+        out.append(value.tobytes())
+    else:
+        raise TypeError("Can't save %r in a save state" % (value,))
+
+def _dump_bytes(tag, data, out):
+    out.append(tag)
+    out.append(COUNT.pack(len(data)))
+    out.append(data)
+
+def _load(data, offset):
+    tag = data[offset]
+    offset += 1
+    if tag == 0x4e:    # N
+        return None, offset
+    if tag == 0x54:    # T
+        return True, offset
+    if tag == 0x46:    # F
+        return False, offset
+    if tag == 0x69:    # i
+        return INT.unpack_from(data, offset)[0], offset + INT.size
+    if tag == 0x64:    # d
+        return FLOAT.unpack_from(data, offset)[0], offset + FLOAT.size
+    if tag in (0x49, 0x73, 0x62):   # I, s, b
+        n = COUNT.unpack_from(data, offset)[0]
+        offset += COUNT.size
+        raw = bytes(data[offset:offset + n])
+        if len(raw) != n:
+            raise IndexError("truncated")
+        offset += n
+        if tag == 0x62:
+            return raw, offset
+        if tag == 0x73:
+            return raw.decode(), offset
+        return int(raw), offset
+    if tag in (0x6c, 0x74):   # l, t
+        n = COUNT.unpack_from(data, offset)[0]
+        offset += COUNT.size
+        items = []
+        for _ in range(n):
+            item, offset = _load(data, offset)
+            items.append(item)
+        return (items if tag == 0x6c else tuple(items)), offset
+    if tag == 0x6d:    # m
+        n = COUNT.unpack_from(data, offset)[0]
+        offset += COUNT.size
+        res = {}
+        for _ in range(n):
+            key, offset = _load(data, offset)
+            res[key], offset = _load(data, offset)
+        return res, offset
+    if tag == 0x61:    # a
+        typecode = chr(data[offset])
+        n = COUNT.unpack_from(data, offset + 1)[0]
+        offset += 1 + COUNT.size
+        size = n * ARRAY_TYPES[typecode]
+        if offset + size > len(data):
+            raise IndexError("truncated")
+        res = array.array(typecode)
+        res.frombytes(data[offset:offset + size])
+        if sys.byteorder == "big":
+            res.byteswap()
+        return res, offset + size
+    raise KeyError("unknown tag %r" % chr(tag))
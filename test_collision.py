@@ -0,0 +1,29 @@
+# Batch mode collision against plain mode. Run with:
+# python -m pytest -q test_collision.py
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import numpybatch
+from test_destroy import system_objects, tile, run
+
+def hit(game, name):
+    player = next(iter(game.objs.by_name("player")))
+    related = player.collision(name)
+    return None if related is None else related[1].pos
+
+@pytest.mark.parametrize("offset", [0, 20, 40])
+def test_batch_collide_many_candidates(tmp_path, offset):
+    # Enough tiles in the player's cells to take the array test; the ones
+    # at x 40+ share a cell with the 32x32 player at 0, 0 but don't touch it
+    count = numpybatch.Batch.COLLIDE_MIN * 2
+    objs = system_objects() + [tile("tile", offset + i % 4, i // 4 % 8) for i in range(count)]
+    project = {"frames": [{"objs": objs, "grid": []}]}
+    (tmp_path / "plain").mkdir()
+    (tmp_path / "batch").mkdir()
+    plain = run(tmp_path / "plain", project, 1)
+    batch = run(tmp_path / "batch", project, 1, batch=True)
+    assert len(batch.spatial.query("tile", 0, 0, 32, 32)) >= numpybatch.Batch.COLLIDE_MIN
+    assert hit(batch, "tile") == hit(plain, "tile")
+    assert (hit(batch, "tile") is None) == (offset == 40)
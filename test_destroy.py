@@ -0,0 +1,76 @@
+# Regression checks for destroying objects while a compiled row still
+# iterates over them. Run with: python -m pytest -q test_destroy.py
+
+import pytest
+
+import bench
+import mmfnull
+import objects
+import jsondir_reader
+
+def system_objects():
+    return [
+        {"type": "Input", "pos": [0, 0], "name": "Input", "attrib": {}, "duplicate_of": None},
+        {"type": "Game", "pos": [0, 0], "name": "Game", "attrib": {}, "duplicate_of": None},
+        {"type": "Active", "pos": [0, 0], "name": "player", "duplicate_of": None, "attrib": {
+            "Sprite name": "player.png", "Movement type": "None", "Damping value": 0.5, "Speed": 0}},
+    ]
+
+def tile(name, x, y):
+    return {"type": "Background", "pos": [x, y], "name": name,
+            "attrib": {"Sprite name": "tile.png"}, "duplicate_of": None}
+
+def run(path, project, frames, batch=False):
+    bench.write_project(str(path), project)
+    reader = jsondir_reader.Reader(str(path))
+    game = mmfnull.Game.from_dict(reader, reader.get_project_file())
+    if batch:
+        game.enable_batch()
+    game.switch_frame(0)
+    for _ in range(frames):
+        game.update()
+    return game
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_destroy_same_named_sources(tmp_path, batch):
+    if batch:
+        pytest.importorskip("numpy")
+    objs = system_objects() + [tile("lava", 8 * i, 0) for i in range(3)]
+    grid = [[{"name": "Collision", "objname": "lava", "arg": "player"},
+             [{"name": "Destroy", "objname": "lava", "value": None}]]]
+    game = run(tmp_path, {"frames": [{"objs": objs, "grid": grid}]}, 3, batch)
+    assert not list(game.objs.by_name("lava"))
+    assert not game.spatial.query("lava", -64, -64, 64, 64)
+
+@pytest.mark.parametrize("pools", [{}, {"Background": 4}])
+def test_destroy_created_objects(tmp_path, pools):
+    objs = system_objects() + [tile("wall", 0, 0)]
+    bullet = {"type": "Background", "pos": [4, 4], "name": "bullet",
+              "attrib": {"Sprite name": "mover.png"}, "duplicate_of": None}
+    grid = [
+        [{"name": "Frame start", "objname": "Game", "arg": None},
+         [{"name": "Set timer #0", "objname": "Game", "value": 0.05}]],
+        [{"name": "Timer expired", "objname": "Game", "arg": 0},
+         [{"name": "Create object", "objname": "Game", "value": bullet},
+          {"name": "Create object", "objname": "Game", "value": bullet},
+          {"name": "Set timer #0", "objname": "Game", "value": 0.05}]],
+        [{"name": "Collision", "objname": "bullet", "arg": "wall"},
+         [{"name": "Destroy", "objname": "bullet", "value": None}]],
+    ]
+    project = {"frames": [{"objs": objs, "grid": grid}], "pools": pools}
+    game = run(tmp_path, project, 60)
+    assert not list(game.objs.by_name("bullet"))
+
+def test_switch_to_preloaded_frame(tmp_path):
+    # Tearing a frame down destroys the Game object too, which must not
+    # end the game
+    frames = [{"objs": system_objects() + [tile("wall", 32 * i, 0) for i in range(n)], "grid": []}
+              for n in (20, 5)]
+    game = run(tmp_path, {"frames": frames}, 1)
+    future = game.preload_frame(1)
+    game.switch_frame(1)
+    assert future.done()
+    assert game.current_frame == 1
+    assert len(game.objs) == 8
+    assert len(list(game.objs.by_name("wall"))) == 5
+    game.update()